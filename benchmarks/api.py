@@ -0,0 +1,241 @@
+"""Latency and queries per request of every route in blog/urls.py.
+
+Seeds a throwaway test database built from settings.DATABASES['default'] with manage.py seed_blog
+(same --seed, same data), then requests each route in turn through the Django test client and
+writes p50/p95/p99 latency, queries per request and the serial request rate as JSON, to compare runs:
+
+    python benchmarks/api.py --posts 100000 --output before.json
+    python benchmarks/api.py --posts 100000 --output after.json --compare before.json
+
+--existing runs against the configured database as it is instead, the write routes change it.
+
+One request at a time: serial_rps is 1 / the mean latency, not the throughput under concurrent load.
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myblog.settings')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import URLResolver, reverse
+from blog.authentication import make_token
+from blog.models import Post, Comment, TaggedPost, RequestProfile
+from blog import urls
+
+PASSWORD = 'benchmark-password'
+#Routes the router adds for viewsets without that action, they only answer 405
+NOT_SERVED = {'post-comments-detail', 'usertag-detail'}
+
+
+def route_names(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from route_names(pattern.url_patterns)
+        elif pattern.name:
+            yield pattern.name
+
+def targets(user):
+    #The rows the requests go to: the hottest post and comment, the user tagged the most, and a
+    #post nobody is tagged in yet so every single tag is a new one
+    post = Post.objects.order_by('-comment_count', 'pk').first()
+    untagged = Post.objects.create(title='benchmark', body='benchmark', author=user)
+    comment = Comment.objects.order_by('-like_count', 'pk').first()
+    tagged = (TaggedPost.objects.values('user').annotate(total=Count('pk')).order_by('-total', 'user')
+              .values_list('user', flat=True).first())
+    users = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    return post, comment, tagged, untagged, users
+
+def scenarios(user, post, comment, tagged, untagged, users, profile):
+    #route name -> (method, url kwargs, query string, body for request i)
+    def rotating(i, count):
+        return [users[(i * count + n) % len(users)] for n in range(count)]
+    return {
+        'index': ('get', {}, '', None),
+        'signup': ('get', {}, '', None),
+        'login': ('get', {}, '', None),
+        'logout': ('get', {}, '', None),
+        'token': ('post', {}, '', lambda i: {'username': user.username, 'password': PASSWORD}),
+        'cache-stats': ('get', {}, '', None),
+        'export': ('get', {}, '?models=post&since=' + (datetime.datetime.now(datetime.timezone.utc)
+                                                      - datetime.timedelta(days=7)).isoformat()
+                   .replace('+', '%2B'), None),
+        'api-root': ('get', {}, '', None),
+        'post-list': ('get', {}, '', None),
+        'post-detail': ('get', {'pk': post.pk}, '', None),
+        'post-like': ('post', {'pk': post.pk}, '', lambda i: {}),
+        'post-tagged-users': ('get', {'pk': post.pk}, '', None),
+        'post-tagged-posts': ('get', {'pk': tagged}, '', None),
+        'post-comments-list': ('get', {'post_pk': post.pk}, '', None),
+        'comment-list': ('get', {}, '', None),
+        'comment-detail': ('get', {'pk': comment.pk}, '', None),
+        'comment-like': ('post', {'pk': comment.pk}, '', lambda i: {}),
+        'usertag-list': ('post', {}, '', lambda i: {'user': rotating(i, 1)[0], 'post': untagged.pk}),
+        'usertag-batch': ('post', {}, '', lambda i: {'post': post.pk, 'users': rotating(i, 10)}),
+        'like-batch': ('post', {}, '', lambda i: {'likes': [
+            {'content_type': 'post', 'object_id': post.pk, 'liked': i % 2 == 0},
+            {'content_type': 'comment', 'object_id': comment.pk, 'liked': i % 2 == 1}]}),
+        'profile-list': ('get', {}, '', None),
+        'profile-detail': ('get', {'pk': profile.pk}, '', None),
+        'profile-download': ('get', {'pk': profile.pk}, '', None),
+        'async-index': ('get', {}, '', None),
+        'async-post-list': ('get', {}, '', None),
+        'async-post-detail': ('get', {'pk': post.pk}, '', None),
+        'async-post-tagged-users': ('get', {'pk': post.pk}, '', None),
+        'async-post-tagged-posts': ('get', {'pk': tagged}, '', None),
+        'async-comment-list': ('get', {}, '', None),
+    }
+
+def percentile(timings, p):
+    #nearest rank, timings sorted
+    return timings[max(math.ceil(len(timings) * p / 100) - 1, 0)]
+
+def measure(client, method, url, body, requests, warmup, token):
+    headers = {'HTTP_AUTHORIZATION': f'Bearer {token}', 'HTTP_ACCEPT': 'application/json'}
+    timings, queries, errors = [], [], 0
+    for i in range(warmup + requests):
+        data = body(i) if body else None
+        start = time.perf_counter()
+        response = getattr(client, method)(url, data, content_type='application/json', **headers) \
+            if data is not None else getattr(client, method)(url, **headers)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+        timings.append(elapsed * 1000)
+        queries.append(int(response.get('X-DB-Queries', 0)))
+        errors += response.status_code >= 400
+    timings.sort()
+    return {
+        'method': method.upper(),
+        'path': url,
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'queries_mean': round(statistics.fmean(queries), 2),
+        'queries_max': max(queries),
+        #one request at a time, 1 / mean latency
+        'serial_rps': round(len(timings) / (sum(timings) / 1000), 1),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, path):
+    with open(path) as file:
+        before = json.load(file)['routes']
+    print(f'\n{"route":<26} {"p50 before":>10} {"p50 now":>9} {"change":>8} {"queries":>9}')
+    for name, result in results.items():
+        if name in before:
+            old = before[name]
+            change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0
+            print(f'{name:<26} {old["p50_ms"]:>10.2f} {result["p50_ms"]:>9.2f} {change:>+7.1f}% '
+                  f'{old["queries_max"]:>4}->{result["queries_max"]:<4}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--comments', type=int, default=50000)
+    parser.add_argument('--likes', type=int, default=100000)
+    parser.add_argument('--tags', type=int, default=20000)
+    parser.add_argument('--skew', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per route')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--routes', nargs='+', help='Only these route names')
+    parser.add_argument('--response-cache', action='store_true', help='Leave the response cache on')
+    parser.add_argument('--existing', action='store_true', help='Use the configured database as it is')
+    parser.add_argument('--output', help='Write the JSON results here')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    settings.BLOG_QUERY_COUNT_HEADERS = True
+    #one process, a per-process cache is enough
+    settings.BLOG_RESPONSE_CACHE_TIMEOUT = 300 if args.response_cache else 0
+    old_name = None if args.existing else connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        if not args.existing:
+            call_command('seed_blog', users=args.users, posts=args.posts, comments=args.comments,
+                         likes=args.likes, tags=args.tags, skew=args.skew, seed=args.seed, drop_indexes=True,
+                         verbosity=0,
+                         stdout=open(os.devnull, 'w'))
+        user, created = User.objects.get_or_create(username='benchmark', defaults={'is_staff': True})
+        if created:
+            user.set_password(PASSWORD)
+            user.save()
+        token = make_token(user)
+        post, comment, tagged, untagged, users = targets(user)
+        client = Client()
+        #one profile for the profile routes, staff ask for it
+        client.get(reverse('blog:post-list'), HTTP_AUTHORIZATION=f'Bearer {token}', HTTP_X_BLOG_PROFILE='1')
+        profile = RequestProfile.objects.order_by('-pk').first()
+        plans = scenarios(user, post, comment, tagged, untagged, users, profile)
+        names = sorted(set(route_names(urls.urlpatterns)) - NOT_SERVED)
+        missing = [name for name in names if name not in plans]
+        if missing:
+            raise SystemExit(f'No benchmark scenario for the routes: {", ".join(missing)}')
+
+        results = {}
+        print(f'{"route":<26} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"serial/s":>8}')
+        for name in args.routes or names:
+            method, kwargs, query, body = plans[name]
+            url = reverse(f'blog:{name}', kwargs=kwargs) + query
+            results[name] = result = measure(client, method, url, body, args.requests, args.warmup, token)
+            print(f'{name:<26} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+                  f'{result["queries_mean"]:>8.1f} {result["serial_rps"]:>8.1f}'
+                  + (f'  {result["errors"]} errors' if result['errors'] else ''))
+
+        report = {
+            'meta': {
+                'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'response_cache': args.response_cache,
+                'data': {name: getattr(args, name) for name in
+                         ('users', 'posts', 'comments', 'likes', 'tags', 'skew', 'seed')} if not args.existing else None,
+                'requests': args.requests,
+                'warmup': args.warmup,
+            },
+            'routes': results,
+        }
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(report, file, indent=2)
+        if args.compare:
+            compare(results, args.compare)
+    finally:
+        if old_name is not None:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Latency of the ?user= substring filter as the user table grows.
+
+Runs against a throwaway test database built from settings.DATABASES['default'],
+so on Postgres it exercises the pg_trgm indexes from blog migration 0013:
+
+    python benchmarks/user_filter.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myblog.settings')
+
+import django
+
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from blog.filters import PostFilter
+from blog.models import Post
+
+
+def random_name(rng):
+    return ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(6, 12)))
+
+def grow_users(target, rng, batch_size=10000):
+    #Users get one post each so the filter's join has something to return
+    current = User.objects.count()
+    while current < target:
+        size = min(batch_size, target - current)
+        users = User.objects.bulk_create([User(username=f'{random_name(rng)}{current + i}', password='!')
+                                          for i in range(size)])
+        Post.objects.bulk_create([Post(title='benchmark', body='benchmark', author=user) for user in users])
+        current += size
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+def time_filter(rng, repeat):
+    timings = []
+    for i in range(repeat):
+        term = random_name(rng)[:rng.randint(3, 5)]
+        queryset = PostFilter({'user': term}, queryset=Post.objects.order_by('pk')).qs[:42]
+        start = time.perf_counter()
+        list(queryset)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        print(f'{"users":>10} {"p50 ms":>8} {"p95 ms":>8}')
+        for size in sorted(args.sizes):
+            grow_users(size, rng)
+            timings = sorted(time_filter(rng, args.repeat))
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            print(f'{size:>10} {statistics.median(timings):>8.2f} {p95:>8.2f}')
+        print(PostFilter({'user': 'abc'}, queryset=Post.objects.all()).qs.explain())
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Throughput of the read endpoints served through WSGI and through ASGI.
+
+Drives myblog/wsgi.py from a pool of threads, like a threaded WSGI server, and myblog/asgi.py from
+one event loop, with the same number of requests in flight, against a throwaway test database
+built from settings.DATABASES['default']. Each query is delayed by --db-latency ms to stand in
+for a slow or remote database. Three runs:
+
+    wsgi        the DRF viewsets, one thread per request in flight
+    asgi-sync   the same viewsets under ASGI, Django runs each one in a thread
+    asgi-async  the async views under /blog/api/async/, see blog.async_views
+
+    python benchmarks/wsgi_vs_asgi.py --concurrency 1 8 32 --db-latency 5
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myblog.settings')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from myblog.asgi import application as asgi_application
+from myblog.wsgi import application as wsgi_application
+from blog.authentication import make_token
+from blog.models import Post, Comment, UserTag
+
+MODES = ('wsgi', 'asgi-sync', 'asgi-async')
+
+
+def seed(posts):
+    users = User.objects.bulk_create([User(username=f'user{i}', password='!') for i in range(100)])
+    created = Post.objects.bulk_create([Post(title=f'title{i}', body='body', author=users[i % 100])
+                                        for i in range(posts)])
+    Comment.objects.bulk_create([Comment(body='body', author=users[i % 100], post=created[i])
+                                 for i in range(posts)])
+    for i in range(posts):
+        UserTag.objects.create(user=users[i % 100], post=created[i])
+    return users[0], created[0]
+
+def paths(mode, user, post):
+    prefix = 'blog:async-' if mode == 'asgi-async' else 'blog:'
+    return [
+        reverse(prefix + 'post-list'),
+        reverse(prefix + 'post-detail', args=[post.pk]),
+        reverse(prefix + 'comment-list'),
+        reverse(prefix + 'post-tagged-users', args=[post.pk]),
+        reverse(prefix + 'post-tagged-posts', args=[user.pk]),
+    ]
+
+def slow_database(latency):
+    def delay(execute, sql, params, many, context):
+        time.sleep(latency)
+        return execute(sql, params, many, context)
+    #every connection, whichever thread opens it
+    connection_created.connect(lambda sender, connection, **kwargs: connection.execute_wrappers.append(delay),
+                               weak=False)
+    connection.execute_wrappers.append(delay)
+
+def wsgi_request(path, token):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http', 'HTTP_AUTHORIZATION': f'Bearer {token}', 'HTTP_ACCEPT': 'application/json',
+    }
+    statuses = []
+    start = time.perf_counter()
+    body = wsgi_application(environ, lambda status, headers: statuses.append(status))
+    b''.join(body)
+    body.close()
+    assert statuses[0].startswith('200'), (path, statuses[0])
+    return time.perf_counter() - start
+
+def run_wsgi(urls, token, requests, concurrency):
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(lambda i: wsgi_request(urls[i % len(urls)], token), range(requests)))
+
+async def asgi_request(path, token):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode()),
+                    (b'accept', b'application/json')],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    start = time.perf_counter()
+    await asgi_application(scope, receive, send)
+    assert messages[0]['status'] == 200, (path, messages[0]['status'])
+    return time.perf_counter() - start
+
+def run_asgi(urls, token, requests, concurrency):
+    async def worker(indexes):
+        return [await asgi_request(urls[i % len(urls)], token) for i in indexes]
+
+    async def main():
+        results = await asyncio.gather(*[worker(range(n, requests, concurrency)) for n in range(concurrency)])
+        return [timing for timings in results for timing in timings]
+    return asyncio.run(main())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--db-latency', type=float, default=5, help='ms added to every query')
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    setup_test_environment()
+    #measure the views, not the response cache
+    settings.BLOG_RESPONSE_CACHE_TIMEOUT = 0
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user, post = seed(args.posts)
+        token = make_token(user)
+        slow_database(args.db_latency / 1000)
+        print(f'{"mode":>10} {"in flight":>9} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8}')
+        for mode in args.modes:
+            urls = paths(mode, user, post)
+            run = run_wsgi if mode == 'wsgi' else run_asgi
+            for concurrency in args.concurrency:
+                start = time.perf_counter()
+                timings = sorted(run(urls, token, args.requests, concurrency))
+                elapsed = time.perf_counter() - start
+                p95 = timings[int(len(timings) * 0.95) - 1] * 1000
+                print(f'{mode:>10} {concurrency:>9} {len(timings) / elapsed:>8.1f} '
+                      f'{statistics.median(timings) * 1000:>8.2f} {p95:>8.2f}')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,72 @@
-from blog.models import Post , Comment, UserTag
+from blog.models import Post , Comment, UserTag, TaggedPost, RequestProfile
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from blog import images
 
 
+class AnnotatedField(serializers.ReadOnlyField):
+    #Reads a queryset annotation, falling back to the model property when missing
+    def __init__(self, annotation, **kwargs):
+        self.annotation = annotation
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        if hasattr(instance, self.annotation):
+            return getattr(instance, self.annotation)
+        return super().get_attribute(instance)
+
 class PostSerializer(serializers.ModelSerializer):
     #user string related fields
     author = serializers.StringRelatedField()
+    #denormalized counters, read straight from the row
+    likes_count = serializers.IntegerField(source='like_count', read_only=True)
+    comments_count = serializers.IntegerField(source='comment_count', read_only=True)
+    tagged_count = serializers.IntegerField(source='tag_count', read_only=True)
+    #annotated by Post.objects.with_stats()
+    last_tag_date = AnnotatedField('last_tagged_at')
+    #thumb and medium urls, a placeholder while they are being made
+    img_variants = serializers.SerializerMethodField()
     class Meta:
         model = Post
-        fields = ['title','body','author','created_at','img','safe','comments_count',
-                  'tagged_count','last_tag_date']
+        fields = ['title','body','author','created_at','img','img_variants','safe','likes_count',
+                  'comments_count','tagged_count','last_tag_date']
+
+    def get_img_variants(self, obj):
+        urls = images.variant_urls(obj)
+        request = self.context.get('request')
+        if urls is None or request is None:
+            return urls
+        return {variant: request.build_absolute_uri(url) for variant, url in urls.items()}
 
 class RelatedPostSerializer(serializers.ModelSerializer):
     class Meta:
         model = Post
         fields = ['title','pk']
 
+class TaggedPostSerializer(serializers.ModelSerializer):
+    #a feed row, shaped like RelatedPostSerializer
+    title = serializers.CharField(source='post_title')
+    pk = serializers.IntegerField(source='post_id')
+    tagged_at = serializers.DateTimeField(source='created_at')
+    class Meta:
+        model = TaggedPost
+        fields = ['title','pk','tagged_at']
+
+class FilteredTaggedPostSerializer(serializers.ModelSerializer):
+    #the same for a post the tagged-posts filters were run on
+    tagged_at = serializers.DateTimeField()
+    class Meta:
+        model = Post
+        fields = ['title','pk','tagged_at']
+
 class CommentSerializer(serializers.ModelSerializer):
     #user string related fields
     author = serializers.StringRelatedField()
     post = RelatedPostSerializer()
+    likes_count = serializers.IntegerField(source='like_count', read_only=True)
     class Meta:
         model = Comment
-        fields = ['body','author','post','created_at']
+        fields = ['body','author','post','created_at','likes_count']
 
 class CommentPostSerializer(serializers.ModelSerializer):
     class Meta:
@@ -34,7 +78,43 @@ class UserTagSerializer(serializers.ModelSerializer):
         model = UserTag
         fields = ['user','post','created_at']
 
+class UserTagBatchSerializer(serializers.Serializer):
+    post = serializers.IntegerField(min_value=1)
+    users = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000)
+    does_not_exist = serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+
+    def validate_post(self, value):
+        if not Post.objects.filter(pk=value).exists():
+            raise serializers.ValidationError(self.does_not_exist.format(pk_value=value))
+        return value
+
+    def validate_users(self, value):
+        #One IN query for all the users, not a lookup per id
+        users = list(dict.fromkeys(value))
+        found = set(User.objects.filter(pk__in=users).values_list('pk', flat=True))
+        missing = [pk for pk in users if pk not in found]
+        if missing:
+            raise serializers.ValidationError([self.does_not_exist.format(pk_value=pk) for pk in missing])
+        return users
+
+class LikeEntrySerializer(serializers.Serializer):
+    content_type = serializers.ChoiceField(choices=['post','comment'])
+    #Like.object_id is an integer column
+    object_id = serializers.IntegerField(min_value=1, max_value=2147483647)
+    liked = serializers.BooleanField()
+
+class LikeBatchSerializer(serializers.Serializer):
+    likes = serializers.ListField(child=LikeEntrySerializer(), allow_empty=False, max_length=1000)
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ['username','email']
\ No newline at end of file
+        fields = ['username','email']
+
+class RequestProfileSerializer(serializers.ModelSerializer):
+    user = serializers.StringRelatedField()
+    #the pstats file
+    download = serializers.HyperlinkedIdentityField(view_name='blog:profile-download')
+    class Meta:
+        model = RequestProfile
+        fields = ['pk','created_at','method','path','user','status_code','duration','queries','timings','trigger','download']
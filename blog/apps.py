@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blog'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from .middleware import install_query_counter
+        from .search import install_sqlite_fts
+        from . import checks, lookups, signals
+        post_migrate.connect(install_sqlite_fts, sender=self)
+        connection_created.connect(install_query_counter)
@@ -0,0 +1,74 @@
+from django.contrib.auth import get_user
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from asgiref.sync import sync_to_async
+from django.shortcuts import render
+from django.http import Http404
+from django.views import View
+from .models import Post
+from .views import PostViewSet, CommentViewSet
+from . import counts
+
+#The hot read endpoints again, as native async views: under ASGI the request stays on the event loop
+#and only the queries leave it, through the async queryset API, so a worker isn't held by a thread
+#per request while the database is slow. The viewset still builds the queryset, the filters, the
+#pagination and the serializer, so both versions answer the same.
+
+
+class AsyncReadView(View):
+    viewset = None
+    action = None
+
+    async def get(self, request, *args, **kwargs):
+        handler = getattr(self.viewset, self.action)
+        #the @action options, e.g. filter_backends
+        view = self.viewset(**getattr(handler, 'kwargs', {}))
+        view.action = self.action
+        view.action_map = {'get': self.action, 'head': self.action}
+        view.args, view.kwargs = args, kwargs
+        view.headers = {}
+        #JSON only: the browsable API renders forms, which query the database
+        view.renderer_classes = [JSONRenderer]
+        request = view.initialize_request(request, *args, **kwargs)
+        view.request = request
+        try:
+            #authentication can read the session or the user
+            await sync_to_async(view.initial)(request, *args, **kwargs)
+            if self.action == 'retrieve':
+                response = await self.retrieve(view)
+            else:
+                response = await self.list(view)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+        response = view.finalize_response(request, response, *args, **kwargs)
+        return response.render()
+
+    async def list(self, view):
+        queryset = view.filter_queryset(view.get_queryset())
+        rows = await view.paginator.apaginate_queryset(queryset, view.request, view)
+        return view.get_paginated_response(view.get_serializer(rows, many=True).data)
+
+    async def retrieve(self, view):
+        queryset = view.filter_queryset(view.get_queryset())
+        lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+        try:
+            instance = await queryset.aget(**{view.lookup_field: view.kwargs[lookup_url_kwarg]})
+        except (ObjectDoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        view.check_object_permissions(view.request, instance)
+        return Response(view.get_serializer(instance).data)
+
+async def index(request):
+    posts = await counts.aexact_count(Post)
+    #the template reads the user, resolve the lazy one before rendering
+    request.user = await sync_to_async(get_user)(request)
+    return render(request, 'blog/base_index.html', {
+        "posts": posts,
+    })
+
+post_list = AsyncReadView.as_view(viewset=PostViewSet, action='list')
+post_detail = AsyncReadView.as_view(viewset=PostViewSet, action='retrieve')
+comment_list = AsyncReadView.as_view(viewset=CommentViewSet, action='list')
+tagged_users = AsyncReadView.as_view(viewset=PostViewSet, action='get_tagged_users')
+tagged_posts = AsyncReadView.as_view(viewset=PostViewSet, action='get_tagged_posts')
@@ -0,0 +1,57 @@
+from rest_framework.authentication import BaseAuthentication, BasicAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.conf import settings
+from django.core import signing
+
+TOKEN_SALT = 'blog.authentication.token'
+
+
+def password_stamp(user):
+    #Changes with the password, so changing it revokes the user's tokens
+    return salted_hmac(TOKEN_SALT, user.password).hexdigest()[:16]
+
+def make_token(user):
+    #HMAC-signed and timestamped, verifying it doesn't run the password hasher
+    return signing.dumps({'id': user.pk, 'stamp': password_stamp(user)}, salt=TOKEN_SALT)
+
+class SignedTokenAuthentication(BaseAuthentication):
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid token header.')
+        try:
+            payload = signing.loads(auth[1].decode(), salt=TOKEN_SALT, max_age=settings.BLOG_TOKEN_MAX_AGE)
+        except (signing.BadSignature, UnicodeError):
+            raise AuthenticationFailed('Invalid or expired token.')
+        user = User.objects.filter(pk=payload['id'], is_active=True).first()
+        if user is None or not constant_time_compare(payload['stamp'], password_stamp(user)):
+            raise AuthenticationFailed('Invalid or expired token.')
+        return (user, auth[1])
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+class CachedBasicAuthentication(BasicAuthentication):
+    #Remembers verified credentials for BLOG_BASIC_AUTH_CACHE_TTL seconds (0 disables it)
+
+    def authenticate_credentials(self, userid, password, request=None):
+        ttl = settings.BLOG_BASIC_AUTH_CACHE_TTL
+        if not ttl:
+            return super().authenticate_credentials(userid, password, request)
+        #The key never contains the password itself
+        key = 'blog:basic-auth:' + salted_hmac(TOKEN_SALT, f'{userid}:{password}', algorithm='sha256').hexdigest()
+        cached = cache.get(key)
+        if cached is not None:
+            user = User.objects.filter(pk=cached[0], is_active=True).first()
+            if user is not None and constant_time_compare(cached[1], password_stamp(user)):
+                return (user, None)
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache.set(key, (user.pk, password_stamp(user)), ttl)
+        return (user, auth)
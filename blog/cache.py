@@ -0,0 +1,128 @@
+from rest_framework.response import Response
+from django.core.cache import caches
+from django.db import transaction
+from django.conf import settings
+from blog import routers
+import hashlib
+import time
+
+#Cached responses are keyed on the versions of the scopes they were built from, a write bumps
+#the versions of the scopes it touches so the old entries are never read again:
+#  posts, comments, tags   the collections behind the list endpoints
+#  post:<pk>, comment:<pk> the single objects behind the retrieve endpoints
+#  titles                  post titles, which comments and tagged posts show
+#  users                   usernames, which the single posts and comments show
+#The model signals (blog.signals) bump for the ordinary saves and deletes. Writes that skip the
+#signals, bulk_create, queryset update()/delete() and raw SQL, don't invalidate anything on their own:
+#their caller bumps the scopes it wrote, or the cache serves the old rows until it expires.
+STATS_KEYS = {'hits': 'blog:cache:hits', 'misses': 'blog:cache:misses'}
+
+
+def get_cache():
+    return caches[settings.BLOG_RESPONSE_CACHE_ALIAS]
+
+def version_key(scope):
+    return f'blog:version:{scope}'
+
+def get_versions(scopes):
+    cache = get_cache()
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            #Start from the clock so an evicted counter can't come back to an old value
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+def incr_versions(scopes):
+    cache = get_cache()
+    for scope in scopes:
+        try:
+            cache.incr(version_key(scope))
+        except ValueError:
+            cache.set(version_key(scope), time.time_ns(), None)
+
+def bump(*scopes):
+    #Now, so the rest of this transaction reads fresh data, and again on commit, in case a
+    #concurrent request cached the not yet committed state under the new versions
+    incr_versions(scopes)
+    transaction.on_commit(lambda: incr_versions(scopes))
+
+def post_changed(*pks):
+    bump('posts', *[f'post:{pk}' for pk in pks])
+
+def comment_changed(*pks):
+    bump('comments', *[f'comment:{pk}' for pk in pks])
+
+def likes_changed(model, pks):
+    if model._meta.model_name == 'post':
+        post_changed(*pks)
+    elif model._meta.model_name == 'comment':
+        comment_changed(*pks)
+
+def response_key(request, name, scopes, per_user):
+    user = f'user:{request.user.pk}' if per_user else 'shared'
+    versions = ','.join(str(version) for version in get_versions(scopes))
+    #the bodies hold absolute urls (image variants, the next page), built on the request's host
+    raw = f'{name}|{request.get_host()}|{request.get_full_path()}|{request.accepted_media_type}|{user}|{versions}'
+    return 'blog:response:' + hashlib.sha256(raw.encode()).hexdigest()
+
+def record(outcome):
+    cache = get_cache()
+    try:
+        cache.incr(STATS_KEYS[outcome])
+    except ValueError:
+        cache.add(STATS_KEYS[outcome], 0, None)
+        cache.incr(STATS_KEYS[outcome])
+
+def stats():
+    values = get_cache().get_many(STATS_KEYS.values())
+    counts = {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+    total = counts['hits'] + counts['misses']
+    counts['hit_ratio'] = counts['hits'] / total if total else None
+    return counts
+
+class CachedResponseMixin:
+    #cache_scopes maps an action to the scopes its response depends on, formatted with the url kwargs
+    cache_scopes = {}
+    #set when the response depends on who asks
+    cache_per_user = False
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_scopes(self):
+        return self.cache_scopes.get(self.action)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        scopes = self.get_cache_scopes()
+        if scopes is None or not settings.BLOG_RESPONSE_CACHE_TIMEOUT:
+            return handler(request, *args, **kwargs)
+        #/post/05/ and /post/5/ share the post:5 scope
+        url_kwargs = {name: str(int(value)) if str(value).isdigit() else value
+                      for name, value in self.kwargs.items()}
+        scopes = [scope.format(**url_kwargs) for scope in scopes]
+        key = response_key(request, f'{self.basename}:{self.action}', scopes, self.cache_per_user)
+        #Whoever just wrote reads their write back: an entry under the new versions may have been
+        #built before it was visible, they skip the lookup and store a fresh one
+        data = None if routers.wrote_recently(request) else get_cache().get(key)
+        if data is not None:
+            record('hits')
+            return Response(data, headers={'X-Cache': 'HIT'})
+        record('misses')
+        #Built from the primary, a lagging replica can still show the rows from before the write that
+        #bumped the versions and it would be served under them. A miss per version change, the hits
+        #spare the primary anyway.
+        token = routers.replica_reads.set(False)
+        try:
+            response = handler(request, *args, **kwargs)
+        finally:
+            routers.replica_reads.reset(token)
+        if response.status_code == 200:
+            get_cache().set(key, response.data, settings.BLOG_RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
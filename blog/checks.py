@@ -0,0 +1,22 @@
+from django.core.checks import Error, Tags, register
+from django.conf import settings
+
+#A cache each process keeps to itself, there a write only moves its own process' versions (blog.cache)
+#and the other workers keep serving the old responses until they expire
+PER_PROCESS_CACHES = {'django.core.cache.backends.locmem.LocMemCache'}
+
+
+@register(Tags.caches)
+def check_response_cache(app_configs, **kwargs):
+    if settings.BLOG_RESPONSE_CACHE_TIMEOUT <= 0:
+        return []
+    alias = settings.BLOG_RESPONSE_CACHE_ALIAS
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in PER_PROCESS_CACHES:
+        return [Error(
+            f"The response cache needs a cache shared by all the workers, CACHES['{alias}'] is per process.",
+            hint="Point BLOG_RESPONSE_CACHE_ALIAS at a Redis or memcached cache, or set "
+                 "BLOG_RESPONSE_CACHE_TIMEOUT = 0.",
+            id='blog.E001',
+        )]
+    return []
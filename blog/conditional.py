@@ -0,0 +1,93 @@
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from django.core.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework import status
+from blog import routers
+import hashlib
+
+
+class ConditionalGetMixin:
+    #Answers If-None-Match / If-Modified-Since with a 304 before anything is serialized.
+    #The validators come from (pk, conditional_fields) of just the rows the body is built from:
+    #the object, or the keyset page window, so they stay an indexed read on any table size.
+    #conditional_fields are the timestamps the representation depends on, etag_fields maps an action
+    #to the values it shows that have no timestamp of their own (the author's username).
+    #Last-Modified is only sent for a single object: a list also changes when one of its rows is
+    #deleted, which no remaining timestamp shows, so If-Modified-Since can't tell it's stale.
+    conditional_actions = ('list', 'retrieve')
+    conditional_fields = ('updated_at',)
+    etag_fields = {}
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_conditional_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            return queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        if hasattr(self.paginator, 'page_queryset'):
+            return self.paginator.page_queryset(queryset, self.request)[0]
+        return queryset
+
+    def get_conditional_count(self):
+        #A total the paginator adds to the body, it changes without the page rows changing
+        if self.action == 'retrieve' or not hasattr(self.paginator, 'get_count'):
+            return None
+        return self.paginator.get_count(self.filter_queryset(self.get_queryset()), self.request)
+
+    def conditional_found(self):
+        #Whether there is something to answer when no row came back: an empty list is one, a missing
+        #object is a 404 the handler answers
+        return self.action != 'retrieve'
+
+    def get_validators(self, request):
+        try:
+            fields = self.conditional_fields + tuple(self.etag_fields.get(self.action, ()))
+            rows = list(self.get_conditional_queryset().values_list('pk', *fields))
+        except (TypeError, ValueError, ValidationError):
+            #a malformed lookup, the handler answers 404
+            return None, None
+        if not rows and not self.conditional_found():
+            return None, None
+        last_modified = None
+        if self.action == 'retrieve':
+            modified = [value for row in rows for value in row[1:len(self.conditional_fields) + 1]
+                        if value is not None]
+            last_modified = max(modified) if modified else None
+        raw = '|'.join([self.basename, self.action, request.get_full_path(), str(request.accepted_media_type),
+                        str(self.get_conditional_count())]
+                       + [','.join(str(value) for value in row) for row in rows])
+        return quote_etag(hashlib.sha256(raw.encode()).hexdigest()), last_modified
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.conditional_actions or request.method not in ('GET', 'HEAD'):
+            return handler(request, *args, **kwargs)
+        etag, last_modified = self.get_validators(request)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        headers = {'ETag': etag}
+        if last_modified is not None:
+            headers['Last-Modified'] = http_date(last_modified.timestamp())
+        #whoever just wrote gets the body, not a 304 for what they had before
+        if not routers.wrote_recently(request) and self.not_modified(request, etag, last_modified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            for name, value in headers.items():
+                response[name] = value
+        return response
+
+    def not_modified(self, request, etag, last_modified):
+        #If-None-Match wins when both are sent
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag in etags
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+        if if_modified_since is not None and last_modified is not None:
+            return int(last_modified.timestamp()) <= if_modified_since
+        return False
@@ -0,0 +1,69 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest, Now
+from .models import Post, Comment, UserTag, Like
+from . import cache
+
+
+def touched(model, values):
+    #A counter is part of the object's representation, so moving it moves updated_at (the ETag) too
+    if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+        values['updated_at'] = Now()
+    return values
+
+def bump(model, pk, field, delta):
+    #Atomic in-database increment, never below zero if the counter has drifted
+    return model.objects.filter(pk=pk).update(**touched(model, {field: Greatest(F(field) + delta, 0)}))
+
+def bump_like_count(content_type_id, object_id, delta):
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    if model is not None and 'like_count' in getattr(model, 'counter_fields', ()):
+        bump(model, object_id, 'like_count', delta)
+
+def count_subquery(queryset, key):
+    #Correlated COUNT(*) of queryset rows grouped by key, 0 when there are none
+    rows = queryset.order_by().values(key).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(rows), 0)
+
+def likes_subquery(model):
+    content_type = ContentType.objects.get_for_model(model)
+    return count_subquery(Like.objects.filter(content_type=content_type, object_id=OuterRef('pk')),
+                          'object_id')
+
+def tags_subquery():
+    return count_subquery(UserTag.objects.filter(post=OuterRef('pk')), 'post')
+
+def counter_specs():
+    #(model, counter field, expression computing the real value)
+    return [
+        (Post, 'like_count', likes_subquery(Post)),
+        (Post, 'comment_count', count_subquery(Comment.objects.filter(post=OuterRef('pk')), 'post')),
+        (Post, 'tag_count', tags_subquery()),
+        (Comment, 'like_count', likes_subquery(Comment)),
+    ]
+
+def refresh(model, field, expression, pks, using=None):
+    #Recompute a counter from the source rows for the given objects, an update() without signals:
+    #the caller bumps the response cache (blog.cache)
+    return model.objects.using(using).filter(pk__in=pks).update(**touched(model, {field: expression}))
+
+def reconcile(model, field, expression, start, end, dry_run=False, using=None):
+    #Repair the counters that drifted in the pk range [start, end)
+    drifted = list(model.objects.using(using).filter(pk__gte=start, pk__lt=end)
+                   .annotate(actual=expression)
+                   .exclude(**{field: F('actual')})
+                   .values_list('pk', flat=True))
+    if drifted and not dry_run:
+        #Recomputed in the UPDATE itself so concurrent writes aren't lost
+        refresh(model, field, expression, drifted, using)
+        cache.likes_changed(model, drifted)
+    return len(drifted)
+
+def reconcile_all(chunk_size=5000, dry_run=False, using=None):
+    #{(model, field): drifted} over whole tables, a pk range at a time
+    drifted = {}
+    for model, field, expression in counter_specs():
+        last_pk = model.objects.using(using).aggregate(last=Max('pk'))['last'] or 0
+        drifted[(model, field)] = sum(reconcile(model, field, expression, start, start + chunk_size, dry_run, using)
+                                      for start in range(1, last_pk + 1, chunk_size))
+    return drifted
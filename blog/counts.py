@@ -0,0 +1,90 @@
+from asgiref.sync import sync_to_async
+from django.db import connections, router
+from django.db.models import Count, F, Min, Sum
+from django.utils import timezone
+from django.conf import settings
+from datetime import timedelta
+import random
+from .models import Post, Comment, TableCount
+
+#Tables whose row count the signals keep in TableCount
+TRACKED = (Post, Comment)
+
+
+def bump(model, delta):
+    #Rides on the write's transaction, on a random slot so concurrent writes rarely wait on each
+    #other's row lock; a missing slot row is created by the next read
+    return (TableCount.objects.filter(table=model._meta.db_table, slot=random.randrange(settings.BLOG_COUNT_SLOTS))
+            .update(count=F('count') + delta))
+
+def refresh(model, using=None):
+    #Exact COUNT(*), also what bulk writes that skip the signals call afterwards. The total goes
+    #to slot 0 and the other slots start over from 0, in one upsert.
+    #Writes committed between the COUNT and the save are off until the next refresh.
+    total = model._default_manager.using(using).count()
+    table, now, slots = model._meta.db_table, timezone.now(), settings.BLOG_COUNT_SLOTS
+    TableCount.objects.using(using).bulk_create(
+        [TableCount(table=table, slot=slot, count=total if slot == 0 else 0, counted_at=now) for slot in range(slots)],
+        update_conflicts=True, unique_fields=['table', 'slot'], update_fields=['count', 'counted_at'])
+    #left over from a larger BLOG_COUNT_SLOTS
+    TableCount.objects.using(using).filter(table=table, slot__gte=slots).delete()
+    return total
+
+def summed():
+    return {'total': Sum('count'), 'counted_at': Min('counted_at'), 'slots': Count('slot')}
+
+def stale_since():
+    return timezone.now() - timedelta(seconds=settings.BLOG_COUNT_MAX_AGE)
+
+def claim(model):
+    #A stale count is recounted by one reader, the others answer with it meanwhile: only one of the
+    #conditional UPDATEs of slot 0's counted_at matches. If that reader dies before its refresh,
+    #the next claim comes BLOG_COUNT_MAX_AGE later.
+    return TableCount.objects.filter(table=model._meta.db_table, slot=0, counted_at__lt=stale_since())
+
+def exact_count(model):
+    #The signal maintained count, recounted once it is older than BLOG_COUNT_MAX_AGE in case
+    #bulk writes or a crash between the write and the bump made it drift
+    if model not in TRACKED:
+        return model._default_manager.count()
+    row = TableCount.objects.filter(table=model._meta.db_table).aggregate(**summed())
+    if row['slots'] != settings.BLOG_COUNT_SLOTS:
+        #never counted, or BLOG_COUNT_SLOTS changed
+        return refresh(model)
+    if row['counted_at'] < stale_since() and claim(model).update(counted_at=timezone.now()):
+        return refresh(model)
+    return max(row['total'], 0)
+
+async def aexact_count(model):
+    #exact_count through the async queryset API, the rare recount runs in a thread
+    if model not in TRACKED:
+        return await model._default_manager.acount()
+    row = await TableCount.objects.filter(table=model._meta.db_table).aaggregate(**summed())
+    if row['slots'] != settings.BLOG_COUNT_SLOTS:
+        return await sync_to_async(refresh)(model)
+    if row['counted_at'] < stale_since() and await claim(model).aupdate(counted_at=timezone.now()):
+        return await sync_to_async(refresh)(model)
+    return max(row['total'], 0)
+
+def approximate_count(model):
+    #The planner's estimate from the last ANALYZE / autovacuum, free to read.
+    #Other backends, and tables Postgres hasn't analyzed yet, get the exact count.
+    connection = connections[router.db_for_read(model)]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [connection.ops.quote_name(model._meta.db_table)])
+            row = cursor.fetchone()
+        if row is not None and row[0] > 0:
+            return row[0]
+    return exact_count(model)
+
+def count(model, approximate=False):
+    return approximate_count(model) if approximate else exact_count(model)
+
+def queryset_count(queryset, approximate=False):
+    #Only an unfiltered queryset is the whole table
+    query = queryset.query
+    if query.where or query.distinct or query.is_sliced or query.combinator:
+        return queryset.count()
+    return count(queryset.model, approximate)
@@ -0,0 +1,11 @@
+from django.core.serializers.json import DjangoJSONEncoder
+import datetime
+
+
+class JSONEncoder(DjangoJSONEncoder):
+    #Full microseconds, DjangoJSONEncoder cuts datetimes to milliseconds, and a seek or a
+    #watermark on a cut timestamp repeats rows
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
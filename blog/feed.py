@@ -0,0 +1,43 @@
+from django.db import connections, router, transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+from .models import Post, UserTag, TaggedPost
+
+#The tagged-posts feed (TaggedPost) follows UserTag: the UserTag signals add and remove single
+#rows, the bulk writes that skip the signals call add() for what they wrote, a post's new title is
+#copied to its rows, and rebuild() recomputes the whole table. None of them bumps the response
+#cache (blog.cache), the callers bump 'tags' themselves.
+
+
+def add(condition, params, using=None):
+    #INSERT ... SELECT of the tags matching condition (on usertag t), with their post's title
+    using = using or router.db_for_write(TaggedPost)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(TaggedPost._meta.db_table)} (user_id, post_id, post_title, created_at, updated_at) '
+            f'SELECT t.user_id, t.post_id, p.title, t.created_at, %s '
+            f'FROM {quote(UserTag._meta.db_table)} t INNER JOIN {quote(Post._meta.db_table)} p ON p.id = t.post_id '
+            f'WHERE {condition} ON CONFLICT (user_id, post_id) DO NOTHING', [now, *params])
+        return cursor.rowcount
+
+def tagged(usertag):
+    return add('t.id = %s', [usertag.pk])
+
+def untagged(usertag):
+    return TaggedPost.objects.filter(user=usertag.user_id, post=usertag.post_id).delete()
+
+def retitled(post):
+    #One indexed UPDATE however many users are tagged in the post
+    return TaggedPost.objects.filter(post=post.pk).update(post_title=post.title, updated_at=Now())
+
+def rebuild(using='default', chunk_size=50000):
+    #For the tags written without signals (imports) or a feed that drifted
+    with transaction.atomic(using=using):
+        #one DELETE, nothing cascades from the feed rows and no signal listens to them
+        TaggedPost.objects.using(using).all().delete()
+        last = UserTag.objects.using(using).order_by('-pk').values_list('pk', flat=True).first() or 0
+        for start in range(1, last + 1, chunk_size):
+            add('t.id >= %s AND t.id < %s', [start, start + chunk_size], using)
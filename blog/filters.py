@@ -1,8 +1,14 @@
 from django_filters import rest_framework as filters
 from blog.models import Post
 
+class SubstringFilter(filters.CharFilter):
+    #icontains served by the trigram indexes, see blog.lookups
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('lookup_expr', 'trgm_icontains')
+        super().__init__(*args, **kwargs)
+
 class PostFilter(filters.FilterSet):
-    user = filters.CharFilter(field_name='author__username', lookup_expr='icontains')
+    user = SubstringFilter(field_name='author__username')
     safe = filters.BooleanFilter(field_name='safe')
     orderings = filters.OrderingFilter(
         fields=(
@@ -0,0 +1,80 @@
+from django.templatetags.static import static
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+from io import BytesIO
+from . import cache
+import posixpath
+import logging
+
+logger = logging.getLogger(__name__)
+
+#Derivatives of Post.img, bounding boxes in pixels. Post.img_variants records them as
+#{'source': img name they were made from, <variant>: storage name}.
+#Made by the blog.process_image task, see blog.tasks
+VARIANTS = {
+    'thumb': (320, 320),
+    'medium': (1024, 1024),
+}
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def render(file, size, image_format):
+    #Re-encoded from the pixels only, which leaves the EXIF block (GPS included) behind
+    with Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = BytesIO()
+        image.save(output, image_format, quality=settings.BLOG_IMAGE_QUALITY)
+    return output.getvalue()
+
+def variant_name(name, variant, image_format):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'variants', f'{stem}_{variant}.{EXTENSIONS[image_format]}')
+
+def process(pk, name):
+    from .models import Post
+    post = Post.objects.filter(pk=pk, img=name).first()
+    if post is None:
+        #Swapped or deleted since, the newer save scheduled its own run
+        return
+    image_format = settings.BLOG_IMAGE_FORMAT
+    variants = {'source': name}
+    #Storage errors propagate so the task is retried
+    with post.img.open('rb') as file:
+        source = file.read()
+    try:
+        rendered = {variant: render(BytesIO(source), size, image_format) for variant, size in VARIANTS.items()}
+    except (UnidentifiedImageError, OSError):
+        #Not an image Pillow can read, the original is served instead
+        logger.warning('Could not make variants of %s', name, exc_info=True)
+        rendered = {}
+    for variant, data in rendered.items():
+        variants[variant] = post.img.storage.save(variant_name(name, variant, image_format), ContentFile(data))
+    if not Post.objects.filter(pk=pk, img=name).update(img_variants=variants, updated_at=timezone.now()):
+        delete_variants(post.img.storage, variants)
+        return
+    cache.post_changed(pk)
+
+def delete_variants(storage, variants):
+    for variant in VARIANTS:
+        if variants.get(variant):
+            storage.delete(variants[variant])
+
+def stored_files(name, variants):
+    #The image and its variants, for the blog.delete_files task
+    return [name] + [variants[variant] for variant in VARIANTS if variants.get(variant)]
+
+def variant_urls(post):
+    #{variant: url}: the placeholder until the worker is done, the original if it couldn't make them
+    if not post.img:
+        return None
+    variants = post.img_variants or {}
+    if variants.get('source') != post.img.name:
+        return {variant: static('blog/placeholder.svg') for variant in VARIANTS}
+    return {variant: post.img.storage.url(variants[variant]) if variants.get(variant) else post.img.url
+            for variant in VARIANTS}
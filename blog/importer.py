@@ -0,0 +1,217 @@
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connections, models
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from django.conf import settings
+from .models import Post, Comment, Like, UserTag, Task
+from .export import EXPORTS
+import datetime
+import re
+import json
+import csv
+import io
+
+#Loads the blog.export format. Rows keep their ids; the counters, updated_at and image variants
+#are not taken from the file, the caller rebuilds them afterwards and bumps the response cache
+#(blog.cache), no signal is sent for the rows.
+MODELS = {name: model for name, (model, watermark, columns) in EXPORTS.items()}
+#user foreign key -> the record column with the username
+USER_COLUMNS = {'author_id': 'author', 'user_id': 'user'}
+
+
+def read_records(file, input_format):
+    #(type, {column: value}); CSV leaves the columns that don't apply blank
+    if input_format == 'csv':
+        for row in csv.DictReader(file):
+            yield row.pop('type'), {column: value for column, value in row.items() if value != ''}
+    else:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                yield record.pop('type'), record
+
+ISO_UTC = re.compile(r'(\d{4}-\d\d-\d\d)T(\d\d:\d\d:\d\d)(?:\.(\d{1,6}))?(?:\+00:00|Z)$')
+
+def parse_timestamp(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        timestamp = parse_datetime(value)
+        if timestamp is None:
+            raise ValueError(f'Invalid timestamp: {value}')
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, datetime.timezone.utc)
+    return timestamp
+
+class Loader:
+    def __init__(self, using='default', batch_size=10000, create_users=False):
+        self.connection = connections[using]
+        self.using = using
+        self.batch_size = batch_size
+        self.create_users = create_users
+        self.users = dict(User.objects.using(using).values_list('username', 'id'))
+        self.content_types = {model._meta.model_name: ContentType.objects.db_manager(using).get_for_model(model).pk
+                              for model in (Post, Comment)}
+        self.buffers = {name: [] for name in MODELS}
+        self.loaded = {name: 0 for name in MODELS}
+        self.now = timezone.now()
+        self.fields = {name: list(model._meta.concrete_fields) for name, model in MODELS.items()}
+        self.plans = {name: self.plan(name) for name in MODELS}
+
+    def add(self, name, record):
+        if name not in self.buffers:
+            raise ValueError(f'Unknown record type {name}')
+        self.buffers[name].append(record)
+        if len(self.buffers[name]) >= self.batch_size:
+            self.flush(name)
+
+    def flush(self, name=None):
+        for name in [name] if name else list(self.buffers):
+            records, self.buffers[name] = self.buffers[name], []
+            if records:
+                self.resolve_users(records)
+                plan = self.plans[name]
+                rows = [self.row(plan, record) for record in records]
+                self.insert(MODELS[name], self.fields[name], rows)
+                if name == 'post':
+                    self.queue_images(records)
+                self.loaded[name] += len(records)
+
+    def resolve_users(self, records):
+        missing = {record[column] for record in records for column in USER_COLUMNS.values()
+                   if record.get(column) is not None and record[column] not in self.users}
+        if not missing:
+            return
+        if not self.create_users:
+            raise LookupError(f'Unknown users: {", ".join(sorted(missing)[:10])}')
+        created = User.objects.using(self.using).bulk_create(
+            [User(username=username, password='!') for username in sorted(missing)])
+        self.users.update({user.username: user.pk for user in created})
+
+    def plan(self, name):
+        #[(record column or None, converter to the database value, value when the column is missing)]
+        #per model field, built once so a row costs a few function calls
+        model = MODELS[name]
+        now = self.connection.ops.adapt_datetimefield_value(self.now)
+        rebuilt = getattr(model, 'counter_fields', ()) + getattr(model, 'worker_fields', ())
+        plan = []
+        for field in self.fields[name]:
+            default = self.database_value(field, field.get_default())
+            if getattr(field, 'auto_now', False):
+                plan.append((None, None, now))
+            elif field.name in rebuilt:
+                plan.append((None, None, default))
+            elif field.attname in USER_COLUMNS:
+                plan.append((USER_COLUMNS[field.attname], self.users.__getitem__, default))
+            elif field.attname == 'content_type_id':
+                plan.append(('content_type', self.content_types.__getitem__, default))
+            else:
+                default = now if getattr(field, 'auto_now_add', False) else default
+                plan.append((field.attname, self.converter(field), default))
+        return plan
+
+    def converter(self, field):
+        #From what JSON or CSV hold to what the driver takes
+        if isinstance(field, models.DateTimeField):
+            return self.timestamp_converter()
+        if isinstance(field, models.BooleanField):
+            return lambda value: value if isinstance(value, bool) else field.to_python(value)
+        if isinstance(field, (models.IntegerField, models.AutoField)):
+            return int
+        if isinstance(field, (models.CharField, models.TextField, models.FileField)):
+            return str
+        return lambda value: self.database_value(field, field.to_python(value))
+
+    def timestamp_converter(self):
+        adapt = self.connection.ops.adapt_datetimefield_value
+        if self.connection.vendor == 'postgresql':
+            #COPY parses ISO 8601 itself
+            return lambda value: value if isinstance(value, str) else adapt(value)
+        if self.connection.vendor == 'sqlite' and settings.USE_TZ:
+            #What adapt_datetimefield_value stores for a UTC time, without parsing it first
+            def convert(value):
+                match = ISO_UTC.match(value) if isinstance(value, str) else None
+                if match is None:
+                    return adapt(parse_timestamp(value))
+                #str() of a datetime leaves out zero microseconds
+                date, time, fraction = match.groups()
+                fraction = fraction.ljust(6, '0') if fraction and fraction.strip('0') else ''
+                return f'{date} {time}.{fraction}' if fraction else f'{date} {time}'
+            return convert
+        return lambda value: adapt(parse_timestamp(value))
+
+    def database_value(self, field, value):
+        if isinstance(field, models.JSONField):
+            return json.dumps(value)
+        return field.get_db_prep_save(value, self.connection)
+
+    def row(self, plan, record):
+        row = []
+        for column, convert, default in plan:
+            if column is None or column not in record:
+                row.append(default)
+            else:
+                value = record[column]
+                row.append(None if value is None else convert(value))
+        return row
+
+    def insert(self, model, fields, rows):
+        if self.connection.vendor == 'postgresql':
+            self.copy(model, fields, rows)
+        else:
+            self.executemany(model, fields, rows)
+
+    def executemany(self, model, fields, rows):
+        #What bulk_create runs, without building a model instance per row, and without the
+        #auto_now_add pre_save that would replace the imported created_at
+        quote = self.connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(model._meta.db_table), ', '.join(quote(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)))
+        with self.connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    def copy(self, model, fields, rows):
+        #COPY ... FROM STDIN in the text format: tab separated, \N for NULL
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(map(copy_value, row)) + '\n')
+        buffer.seek(0)
+        quote = self.connection.ops.quote_name
+        sql = 'COPY {} ({}) FROM STDIN'.format(
+            quote(model._meta.db_table), ', '.join(quote(field.column) for field in fields))
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(sql, buffer)
+
+    def queue_images(self, records):
+        #The variants are made from the imported files by the task worker
+        Task.objects.using(self.using).bulk_create([Task(name='blog.process_image', args=[record['id'], record['img']])
+                                                    for record in records if record.get('img')])
+
+    def reset_sequences(self):
+        #The ids came from the file, the next generated ones start after them
+        statements = self.connection.ops.sequence_reset_sql(no_style(), list(MODELS.values()))
+        with self.connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def analyze(self):
+        quote = self.connection.ops.quote_name
+        with self.connection.cursor() as cursor:
+            for model in MODELS.values():
+                cursor.execute('ANALYZE ' + quote(model._meta.db_table))
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    return str(value).translate(COPY_ESCAPES)
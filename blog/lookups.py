@@ -0,0 +1,22 @@
+from django.db.models import CharField, TextField
+from django.db.models.lookups import IContains, PatternLookup
+
+
+class TrigramIContains(PatternLookup):
+    #icontains that a pg_trgm GIN index can serve: Postgres' own icontains compares
+    #UPPER(col::text), which a gin_trgm_ops index on the column doesn't cover, this uses col ILIKE.
+    #Other backends get the regular icontains SQL.
+    lookup_name = 'trgm_icontains'
+
+    def as_sql(self, compiler, connection):
+        return IContains(self.lhs, self.rhs).as_sql(compiler, connection)
+
+    def as_postgresql(self, compiler, connection):
+        if not self.rhs_is_direct_value():
+            return self.as_sql(compiler, connection)
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', lhs_params + rhs_params
+
+CharField.register_lookup(TrigramIContains)
+TextField.register_lookup(TrigramIContains)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.conf import settings
+from blog import export
+
+
+class Command(BaseCommand):
+    help = 'Streams posts, comments, likes and tags as NDJSON or CSV, optionally only what changed since a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=export.OUTPUTS, default='ndjson')
+        parser.add_argument('--models', default=','.join(export.EXPORTS),
+                            help='Comma separated, from ' + ', '.join(export.EXPORTS))
+        parser.add_argument('--since', help='ISO 8601 watermark, only rows written after it. The one printed '
+                                              'at the end overlaps this export, rows can come twice')
+        parser.add_argument('--file', help='Write here instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=settings.BLOG_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        names = options['models'].split(',')
+        if any(name not in export.EXPORTS for name in names):
+            raise CommandError(f'--models must be from {", ".join(export.EXPORTS)}')
+        try:
+            since = export.parse_since(options['since'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        watermark = export.next_since(timezone.now())
+        lines = export.lines(options['output'], names, since, options['chunk_size'])
+        if options['file']:
+            with open(options['file'], 'w', newline='', encoding='utf-8') as file:
+                file.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
+        #on stderr so it doesn't end up in the export
+        self.stderr.write(f'Next --since: {watermark.isoformat()}')
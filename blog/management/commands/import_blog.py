@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connections, transaction
+from blog import cache, counters, counts, feed, importer, search
+from blog.models import Post, Comment
+import time
+import sys
+
+
+class Command(BaseCommand):
+    help = ('Bulk loads posts, comments, likes and tags in the export_blog format (JSONL or CSV), '
+            'keeping their ids, then rebuilds the counters and the feed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='JSONL or CSV files, - for stdin')
+        parser.add_argument('--input-format', choices=['jsonl', 'csv'],
+                            help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--create-users', action='store_true',
+                            help='Create the users the map doesn\'t know, without a usable password')
+        parser.add_argument('--drop-indexes', action='store_true',
+                            help='Drop the indexes for the load and build them at the end, in its transaction: '
+                                 'faster, but the tables are locked until it commits')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+        loader = importer.Loader(using, options['batch_size'], options['create_users'])
+        start = time.perf_counter()
+        try:
+            #one transaction: the foreign keys are only checked at the commit, so the files can come in any
+            #order, and a failed load leaves the indexes, counters and feed as they were
+            with transaction.atomic(using=using):
+                dropped = self.drop_indexes(connection) if options['drop_indexes'] else []
+                search.drop_sqlite_fts_triggers(using)
+                self.load_all(loader, options)
+                loader.flush()
+                loader.reset_sequences()
+                search.install_sqlite_fts(using)
+                self.create_indexes(connection, dropped)
+                elapsed = time.perf_counter() - start
+
+                counters.reconcile_all(using=using)
+                feed.rebuild(using)
+                for model in (Post, Comment):
+                    counts.refresh(model, using)
+                #everything the loaded rows show up in, the rows skipped the signals
+                cache.bump('posts', 'comments', 'tags', 'titles')
+        except (IntegrityError, LookupError, ValueError) as error:
+            raise CommandError(str(error))
+        #planner statistics, they don't roll back anyway
+        loader.analyze()
+
+        total = sum(loader.loaded.values())
+        for name, loaded in loader.loaded.items():
+            self.stdout.write(f'{name}: {loaded}')
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(self.style.SUCCESS(f'{total} rows loaded in {elapsed:.2f}s ({rate:.0f} rows/s)'))
+
+    def load_all(self, loader, options):
+        for path in options['files']:
+            self.load(loader, path, options['input_format'])
+
+    def load(self, loader, path, input_format):
+        input_format = input_format or ('csv' if path.endswith('.csv') else 'jsonl')
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            for name, record in importer.read_records(file, input_format):
+                loader.add(name, record)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+    def drop_indexes(self, connection):
+        #Building an index once over all the rows beats updating it row by row. The editor isn't entered,
+        #the SQLite one refuses to open in a transaction; remove_index and add_index just run their statement.
+        dropped = []
+        schema_editor = connection.schema_editor()
+        for model in importer.MODELS.values():
+            for index in model._meta.indexes:
+                schema_editor.remove_index(model, index)
+                dropped.append((model, index))
+        return dropped
+
+    def create_indexes(self, connection, dropped):
+        schema_editor = connection.schema_editor()
+        for model, index in dropped:
+            schema_editor.add_index(model, index)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from blog import counters
+
+
+class Command(BaseCommand):
+    help = 'Re-checks the denormalized like/comment/tag counters in chunks and repairs any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the drifted counters')
+
+    def handle(self, *args, **options):
+        drifted = counters.reconcile_all(options['chunk_size'], options['dry_run'])
+        for (model, field), repaired in drifted.items():
+            self.stdout.write(f'{model._meta.label}.{field}: {repaired} drifted')
+        action = 'found' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'{sum(drifted.values())} counters {action}'))
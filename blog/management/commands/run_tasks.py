@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from blog import tasks
+import time
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued blog tasks (image resizing, file deletion) on a pool of threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Tasks claimed at a time')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no task is due instead of polling')
+
+    def handle(self, *args, **options):
+        #One worker runs the tasks in this thread
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='blog-tasks') as executor:
+                self.work(lambda claimed: executor.map(self.run_in_thread, claimed), options)
+        else:
+            self.work(lambda claimed: map(tasks.run, claimed), options)
+
+    def work(self, run_all, options):
+        succeeded = failed = 0
+        try:
+            while True:
+                claimed = tasks.claim(options['batch_size'])
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                for ok in run_all(claimed):
+                    succeeded += ok
+                    failed += not ok
+        except KeyboardInterrupt:
+            #whatever was claimed and not finished is retried once its lease runs out
+            pass
+        self.stdout.write(self.style.SUCCESS(f'{succeeded} tasks done, {failed} attempts failed'))
+
+    def run_in_thread(self, task):
+        try:
+            return tasks.run(task)
+        finally:
+            #the pool thread's own connection
+            close_old_connections()
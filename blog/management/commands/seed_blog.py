@@ -0,0 +1,50 @@
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from blog.management.commands import import_blog
+from blog import seed
+import random
+
+
+class Command(import_blog.Command):
+    help = ('Generates users, posts, comments, likes and tags with power-law skew (busy authors, hot posts) '
+            'and bulk loads them like import_blog')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--likes', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=20000)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Power-law exponent, 0 spreads everything evenly')
+        parser.add_argument('--days', type=int, default=365, help='The posts are spread over this many days')
+        parser.add_argument('--seed', type=int, default=42, help='Same seed, same data on the same database')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--drop-indexes', action='store_true',
+                            help='Drop the indexes for the load and build them at the end, in its transaction: '
+                                 'faster, but the tables are locked until it commits')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if any(options[name] < 0 for name in ('users', 'posts', 'comments', 'likes', 'tags')):
+            raise CommandError('The counts can\'t be negative')
+        if not options['users'] and any(options[name] for name in ('posts', 'comments', 'likes', 'tags')):
+            raise CommandError('--users must be at least 1 for posts, comments, likes or tags')
+        if not options['posts'] and any(options[name] for name in ('comments', 'likes', 'tags')):
+            raise CommandError('--posts must be at least 1 for comments, likes or tags')
+        start = seed.first_ids(options['database'])
+        self.names = seed.usernames(start, options['users'])
+        self.records = seed.records(random.Random(options['seed']), self.names, options['posts'], options['comments'],
+                                    options['likes'], options['tags'], options['skew'], options['days'], start)
+        self.stdout.write(f'users: {len(self.names)}')
+        super().handle(*args, create_users=False, **options)
+
+    def load_all(self, loader, options):
+        #The users too are created in the load's transaction, a failed run leaves nothing behind
+        users = User.objects.using(options['database'])
+        for i in range(0, len(self.names), options['batch_size']):
+            names = self.names[i:i + options['batch_size']]
+            users.bulk_create([User(username=name, password='!') for name in names], ignore_conflicts=True)
+            loader.users.update(users.filter(username__in=names).values_list('username', 'id'))
+        for name, record in self.records:
+            loader.add(name, record)
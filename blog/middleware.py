@@ -0,0 +1,149 @@
+from django.utils.decorators import sync_and_async_middleware
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.conf import settings
+from contextvars import ContextVar
+from blog import profiling, routers
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+#The QueryStats of the request being served. sync_to_async copies it to the threads the ORM runs
+#in under ASGI, so every connection's execute wrapper adds to the same object.
+query_stats = ContextVar('blog_query_stats', default=None)
+
+
+def allows_replica_reads(request):
+    #Writes read their own rows back, and so does whoever wrote in the last
+    #BLOG_REPLICA_STICKY_SECONDS, the cookie is there until the replicas have caught up
+    return request.method in SAFE_METHODS and not routers.wrote_recently(request)
+
+def stick_to_primary(request, response):
+    if request.method not in SAFE_METHODS:
+        response.set_cookie(settings.BLOG_REPLICA_COOKIE, '1', max_age=settings.BLOG_REPLICA_STICKY_SECONDS,
+                            httponly=True, samesite='Lax')
+    return response
+
+@sync_and_async_middleware
+def ReplicaMiddleware(get_response):
+    #Tells blog.routers.ReplicaRouter whether this request's reads may go to a replica
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = routers.replica_reads.set(allows_replica_reads(request))
+            try:
+                response = await get_response(request)
+            finally:
+                routers.replica_reads.reset(token)
+            return stick_to_primary(request, response)
+    else:
+        def middleware(request):
+            token = routers.replica_reads.set(allows_replica_reads(request))
+            try:
+                response = get_response(request)
+            finally:
+                routers.replica_reads.reset(token)
+            return stick_to_primary(request, response)
+    return middleware
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+def count_query(execute, sql, params, many, context):
+    stats = query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.time += time.perf_counter() - start
+
+def install_query_counter(connection, **kwargs):
+    #connection_created receiver, connections are per thread and opened lazily
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+def report_queries(request, response, stats):
+    logger.debug('%s %s: %d queries in %.1f ms', request.method, request.path, stats.count, stats.time * 1000)
+    if settings.BLOG_QUERY_COUNT_HEADERS:
+        response['X-DB-Queries'] = str(stats.count)
+        response['X-DB-Time-ms'] = f'{stats.time * 1000:.1f}'
+    return response
+
+@sync_and_async_middleware
+def QueryCountMiddleware(get_response):
+    #Counts the queries and the time spent in them per request, see BLOG_QUERY_COUNT_HEADERS.
+    #A streamed body's queries run after the headers are sent and aren't counted.
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats = QueryStats()
+            token = query_stats.set(stats)
+            try:
+                response = await get_response(request)
+            finally:
+                query_stats.reset(token)
+            return report_queries(request, response, stats)
+    else:
+        def middleware(request):
+            for connection in connections.all():
+                install_query_counter(connection)
+            stats = QueryStats()
+            token = query_stats.set(stats)
+            try:
+                response = get_response(request)
+            finally:
+                query_stats.reset(token)
+            return report_queries(request, response, stats)
+    return middleware
+
+def report_timings(request, response, current, server_timing):
+    if server_timing:
+        response['Server-Timing'] = current.header()
+    if current.profiler is not None:
+        #saving the profile isn't part of the request's queries
+        token = query_stats.set(None)
+        try:
+            profiling.finish(request, response, current)
+        finally:
+            query_stats.reset(token)
+    return response
+
+@sync_and_async_middleware
+def ServerTimingMiddleware(get_response):
+    #Server-Timing header and profiles, see blog.profiling. Goes after QueryCountMiddleware for the db phase.
+    #cProfile follows one thread, only WSGI requests are profiled.
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            current = profiling.Timings(query_stats.get())
+            token = profiling.timings.set(current)
+            try:
+                response = await get_response(request)
+            finally:
+                profiling.timings.reset(token)
+            #request.user may still be a lazy session lookup
+            server_timing = await sync_to_async(profiling.server_timing)(request)
+            return report_timings(request, response, current, server_timing)
+    else:
+        def middleware(request):
+            current = profiling.Timings(query_stats.get(), can_profile=True)
+            if profiling.sampled():
+                current.start_profile('sampled')
+            token = profiling.timings.set(current)
+            try:
+                response = get_response(request)
+            except BaseException:
+                if current.profiler is not None:
+                    current.stop_profile()
+                raise
+            finally:
+                profiling.timings.reset(token)
+            return report_timings(request, response, current, profiling.server_timing(request))
+    return middleware
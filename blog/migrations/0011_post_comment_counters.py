@@ -0,0 +1,56 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset, key):
+    rows = queryset.order_by().values(key).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(rows), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    UserTag = apps.get_model('blog', 'UserTag')
+    Like = apps.get_model('blog', 'Like')
+    likes = lambda model: count_subquery(Like.objects.filter(
+        content_type__app_label='blog', content_type__model=model, object_id=OuterRef('pk')), 'object_id')
+    Post.objects.update(
+        like_count=likes('post'),
+        comment_count=count_subquery(Comment.objects.filter(post=OuterRef('pk')), 'post'),
+        tag_count=count_subquery(UserTag.objects.filter(post=OuterRef('pk')), 'post'),
+    )
+    Comment.objects.update(like_count=likes('comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_like'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='tag_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:05
+
+from django.db import migrations
+
+
+POSTGRES_FORWARDS = [
+    "ALTER TABLE blog_post ADD COLUMN search_vector tsvector",
+    """
+    CREATE FUNCTION blog_post_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(NEW.body, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(
+                (SELECT username FROM auth_user WHERE id = NEW.author_id), '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER blog_post_search_vector_trigger BEFORE INSERT OR UPDATE OF title, body, author_id "
+    "ON blog_post FOR EACH ROW EXECUTE PROCEDURE blog_post_search_vector_update()",
+    "UPDATE blog_post SET title = title",
+    "CREATE INDEX blog_post_search_vector_idx ON blog_post USING GIN (search_vector)",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS blog_post_search_vector_trigger ON blog_post",
+    "DROP FUNCTION IF EXISTS blog_post_search_vector_update()",
+    "ALTER TABLE blog_post DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run_postgres(statements):
+    #SQLite uses an FTS5 table installed after migrate instead, see blog.search.install_sqlite_fts
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_post_comment_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgres(POSTGRES_FORWARDS), run_postgres(POSTGRES_BACKWARDS)),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:40
+
+from django.db import migrations
+
+
+#GIN trigram indexes for the trgm_icontains lookup (blog.lookups), Postgres only:
+#the other backends fall back to a plain LIKE
+POSTGRES_FORWARDS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS blog_user_username_trgm_idx ON auth_user USING GIN (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS blog_post_title_trgm_idx ON blog_post USING GIN (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS blog_post_body_trgm_idx ON blog_post USING GIN (body gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS blog_user_username_trgm_idx",
+    "DROP INDEX IF EXISTS blog_post_title_trgm_idx",
+    "DROP INDEX IF EXISTS blog_post_body_trgm_idx",
+]
+
+
+def run_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('blog', '0012_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgres(POSTGRES_FORWARDS), run_postgres(POSTGRES_BACKWARDS)),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_at', 'id'], name='blog_comment_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['content_type', 'object_id'], name='blog_like_object_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['safe', 'id'], name='blog_post_safe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-safe', 'id'], name='blog_post_safe_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['title', 'id'], name='blog_post_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-title', 'id'], name='blog_post_title_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_at', 'id'], name='blog_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('safe', True)), fields=['id'], name='blog_post_safe_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertag',
+            index=models.Index(fields=['post', 'created_at'], name='blog_usertag_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertag',
+            index=models.Index(fields=['user', 'created_at'], include=('post',), name='blog_usertag_user_idx'),
+        ),
+    ]
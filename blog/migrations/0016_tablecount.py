@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_post_comment_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableCount',
+            fields=[
+                ('table', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('count', models.BigIntegerField(default=0)),
+                ('counted_at', models.DateTimeField()),
+            ],
+        ),
+    ]
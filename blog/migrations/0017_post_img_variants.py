@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0016_tablecount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='img_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
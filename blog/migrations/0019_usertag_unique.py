@@ -0,0 +1,37 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:50
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Now
+
+
+def remove_duplicate_tags(apps, schema_editor):
+    #Keeps the first tag of every (user, post), the unique constraint can't be added over duplicates
+    UserTag = apps.get_model('blog', 'UserTag')
+    Post = apps.get_model('blog', 'Post')
+    first = UserTag.objects.values('user', 'post').annotate(first=Min('pk')).values('first')
+    duplicates = UserTag.objects.exclude(pk__in=Subquery(first))
+    posts = set(duplicates.values_list('post', flat=True))
+    if not posts:
+        return
+    duplicates.delete()
+    tags = UserTag.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('pk'))
+    Post.objects.filter(pk__in=posts).update(tag_count=Coalesce(Subquery(tags.values('total')), 0),
+                                             updated_at=Now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('blog', '0018_task'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='usertag',
+            unique_together={('user', 'post')},
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_feed(apps, schema_editor):
+    UserTag = apps.get_model('blog', 'UserTag')
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    rows = UserTag.objects.order_by().values_list('user_id', 'post_id', 'post__title', 'created_at')
+    batch = []
+    for user_id, post_id, title, created_at in rows.iterator(chunk_size=2000):
+        batch.append(TaggedPost(user_id=user_id, post_id=post_id, post_title=title, created_at=created_at))
+        if len(batch) == 2000:
+            TaggedPost.objects.bulk_create(batch)
+            batch = []
+    TaggedPost.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('blog', '0019_usertag_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaggedPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_title', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='usertag',
+            name='blog_usertag_user_idx',
+        ),
+        migrations.AddField(
+            model_name='taggedpost',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post'),
+        ),
+        migrations.AddField(
+            model_name='taggedpost',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='taggedpost',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='blog_taggedpost_feed_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='taggedpost',
+            unique_together={('user', 'post')},
+        ),
+        migrations.RunPython(backfill_feed, migrations.RunPython.noop),
+    ]
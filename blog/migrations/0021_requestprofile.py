@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('blog', '0020_taggedpost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=255)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('duration', models.FloatField()),
+                ('queries', models.PositiveIntegerField(default=0)),
+                ('timings', models.JSONField(default=dict)),
+                ('trigger', models.CharField(choices=[('sampled', 'Sampled'), ('requested', 'Requested')], max_length=10)),
+                ('stats', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
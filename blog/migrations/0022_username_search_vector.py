@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:05
+
+from django.db import migrations
+
+
+#A renamed user's posts get their search_vector recomputed: setting author_id fires the
+#blog_post_search_vector_trigger of migration 0012
+POSTGRES_FORWARDS = [
+    """
+    CREATE FUNCTION blog_user_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE blog_post SET author_id = author_id WHERE author_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER blog_user_search_vector_trigger AFTER UPDATE OF username ON auth_user "
+    "FOR EACH ROW WHEN (OLD.username IS DISTINCT FROM NEW.username) "
+    "EXECUTE PROCEDURE blog_user_search_vector_update()",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS blog_user_search_vector_trigger ON auth_user",
+    "DROP FUNCTION IF EXISTS blog_user_search_vector_update()",
+]
+
+
+def run_postgres(statements):
+    #SQLite gets the same from the blog_post_fts_author trigger, see blog.search.install_sqlite_fts
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('blog', '0021_requestprofile'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgres(POSTGRES_FORWARDS), run_postgres(POSTGRES_BACKWARDS)),
+    ]
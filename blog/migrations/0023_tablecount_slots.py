@@ -0,0 +1,30 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0022_username_search_vector'),
+    ]
+
+    #The counts are recounted by the first read, dropping them loses nothing
+    operations = [
+        migrations.DeleteModel(
+            name='TableCount',
+        ),
+        migrations.CreateModel(
+            name='TableCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=100)),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('count', models.BigIntegerField(default=0)),
+                ('counted_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('table', 'slot')},
+            },
+        ),
+    ]
@@ -1,9 +1,98 @@
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
-from django.db import models
+from django.db.models import Max, OuterRef, Q, Subquery
+from django.db import connections, models, transaction
+from django.utils import timezone
+import zlib
 
 # Create your models here.
+class LikeManager(models.Manager):
+    def toggle(self, user, model, object_id):
+        #One DELETE ... RETURNING, or INSERT ... ON CONFLICT DO NOTHING when nothing was deleted,
+        #plus the counter UPDATE ... RETURNING, all in one transaction. Bypasses the Like signals,
+        #the caller bumps the response cache (blog.cache.likes_changed).
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        like_table = quote(self.model._meta.db_table)
+        object_table = quote(model._meta.db_table)
+        #No row has an id out of the column's range, and the query would fail on it (DataError on
+        #Postgres, OverflowError in the SQLite driver)
+        low, high = connection.ops.integer_field_range(self.model._meta.get_field('object_id').get_internal_type())
+        if not (-2 ** 63 if low is None else low) <= object_id <= (2 ** 63 - 1 if high is None else high):
+            raise model.DoesNotExist
+        content_type = ContentType.objects.db_manager(self.db).get_for_model(model)
+        params = [user.pk, content_type.pk, object_id]
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {like_table} WHERE user_id = %s AND content_type_id = %s AND object_id = %s '
+                f'RETURNING id', params)
+            liked = cursor.fetchone() is None
+            delta = -1
+            now = connection.ops.adapt_datetimefield_value(timezone.now())
+            if liked:
+                cursor.execute(
+                    f'INSERT INTO {like_table} (user_id, content_type_id, object_id, created_at) '
+                    f'VALUES (%s, %s, %s, %s) ON CONFLICT (user_id, content_type_id, object_id) DO NOTHING '
+                    f'RETURNING id', params + [now])
+                #A concurrent request already liked it
+                delta = 1 if cursor.fetchone() else 0
+            cursor.execute(
+                f'UPDATE {object_table} SET like_count = CASE WHEN like_count + %s < 0 THEN 0 '
+                f'ELSE like_count + %s END, updated_at = %s WHERE id = %s RETURNING like_count',
+                [delta, delta, now, object_id])
+            row = cursor.fetchone()
+            if row is None:
+                #Rolls back the like of a missing object
+                raise model.DoesNotExist
+        return liked, row[0]
+
+    def apply_batch(self, user, entries):
+        #entries: (model, object_id, liked) triples, the last one for an object wins.
+        #Returns {(model, object_id): (liked, like_count)} for the objects that exist. No signals,
+        #the caller bumps the response cache for them.
+        from . import counters
+        desired = {}
+        for model, object_id, liked in entries:
+            desired[(model, object_id)] = liked
+        by_model = {}
+        for model, object_id in desired:
+            by_model.setdefault(model, []).append(object_id)
+        with transaction.atomic(using=self.db):
+            existing = {model: set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+                        for model, ids in by_model.items()}
+            content_types = ContentType.objects.db_manager(self.db).get_for_models(*by_model)
+            to_like, to_unlike = [], {}
+            for (model, object_id), liked in desired.items():
+                if object_id not in existing[model]:
+                    continue
+                if liked:
+                    to_like.append(Like(user=user, content_type=content_types[model], object_id=object_id))
+                else:
+                    to_unlike.setdefault(content_types[model].pk, []).append(object_id)
+            if to_like:
+                self.bulk_create(to_like, ignore_conflicts=True)
+            if to_unlike:
+                self._delete_without_signals(user, to_unlike)
+            for model, ids in existing.items():
+                counters.refresh(model, 'like_count', counters.likes_subquery(model), ids)
+            counts = {(model, pk): count for model, ids in existing.items()
+                      for pk, count in model.objects.filter(pk__in=ids).values_list('pk', 'like_count')}
+        return {key: (liked, counts[key]) for key, liked in desired.items() if key in counts}
+
+    def _delete_without_signals(self, user, object_ids):
+        #One DELETE of the user's likes on {content type id: object ids}, where queryset.delete() would
+        #send the Like signals row by row; the callers refresh the counters the signals would have bumped
+        connection = connections[self.db]
+        conditions, params = [], [user.pk]
+        for content_type_id, ids in object_ids.items():
+            conditions.append(f'(content_type_id = %s AND object_id IN ({", ".join(["%s"] * len(ids))}))')
+            params += [content_type_id, *ids]
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {connection.ops.quote_name(self.model._meta.db_table)} '
+                           f'WHERE user_id = %s AND ({" OR ".join(conditions)})', params)
+            return cursor.rowcount
+
 class Like(models.Model):
     user = models.ForeignKey(User,on_delete=models.CASCADE, null=False)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
@@ -11,13 +100,84 @@ class Like(models.Model):
     content_object = GenericForeignKey('content_type', 'object_id')
     created_at = models.DateTimeField(auto_now_add=True,editable=False)
 
+    objects = LikeManager()
+
     def __str__(self):
         return str(self.user.pk) + ' liked ' + str(self.content_object)
 
     class Meta:
         unique_together = ('user', 'content_type', 'object_id')
+        indexes = [
+            #like counts and reconcile_counters go by object, the toggle uses the unique index
+            models.Index(fields=['content_type', 'object_id'], name='blog_like_object_idx'),
+        ]
 
-class Post(models.Model):
+class CountersMixin:
+    #Denormalized counters, only ever written with F() updates (see blog.counters)
+    counter_fields = ()
+    #fields only background jobs write
+    worker_fields = ()
+
+    def save(self, *args, **kwargs):
+        #A full save of a possibly stale instance must not overwrite the counters
+        if (not args and not self._state.adding and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            skipped = self.counter_fields + self.worker_fields
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in skipped]
+        super().save(*args, **kwargs)
+
+class ChangeTrackingMixin(CountersMixin):
+    #Remembers the field values as loaded, so saving an existing row writes only the fields that
+    #changed (none: no UPDATE and no signals) and the post_save handlers get them as update_fields
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot()
+        return instance
+
+    def snapshot(self, fields=None):
+        #In the database representation, which compares FieldFiles by name and JSON by content
+        if not hasattr(self, '_loaded_values'):
+            self._loaded_values = {}
+        for field in self._meta.concrete_fields:
+            wanted = fields is None or field.name in fields or field.attname in fields
+            if wanted and field.attname in self.__dict__:
+                self._loaded_values[field.attname] = field.get_prep_value(self.__dict__[field.attname])
+
+    def changed_fields(self):
+        loaded = getattr(self, '_loaded_values', {})
+        return [field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname in self.__dict__
+                and (field.attname not in loaded
+                     or field.get_prep_value(self.__dict__[field.attname]) != loaded[field.attname])]
+
+    def save(self, *args, **kwargs):
+        if (hasattr(self, '_loaded_values') and not args and not self._state.adding
+                and kwargs.get('update_fields') is None and not kwargs.get('force_insert')):
+            skipped = self.counter_fields + self.worker_fields
+            changed = [name for name in self.changed_fields() if name not in skipped]
+            if not changed:
+                return
+            kwargs['update_fields'] = changed + [field.name for field in self._meta.concrete_fields
+                                                 if getattr(field, 'auto_now', False) and field.name not in changed]
+        super().save(*args, **kwargs)
+        self.snapshot(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self.snapshot(fields)
+
+class PostQuerySet(models.QuerySet):
+    def with_stats(self):
+        #Compute the serializer stats in the same query instead of one query per row
+        tags = UserTag.objects.filter(post=OuterRef('pk')).order_by().values('post')
+        return self.select_related('author').annotate(
+            last_tagged_at=Subquery(tags.annotate(last=Max('created_at')).values('last')),
+        )
+
+class Post(ChangeTrackingMixin, models.Model):
     title = models.CharField(max_length=100,null=False,blank=False)
     body = models.CharField(max_length=255,null=False,blank=False)
     author = models.ForeignKey(User,on_delete=models.CASCADE, null=False)
@@ -26,6 +186,16 @@ class Post(models.Model):
     safe = models.BooleanField(default=True)
     tagged_users = models.ManyToManyField(User, through='UserTag', related_name='tagged_users')
     likes = GenericRelation(Like)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    tag_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    #resized copies of img, see blog.images
+    img_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = PostQuerySet.as_manager()
+    counter_fields = ('like_count', 'comment_count', 'tag_count')
+    worker_fields = ('img_variants',)
 
     @property
     def tagged_count(self):
@@ -43,33 +213,175 @@ class Post(models.Model):
         return self.title
     
     def delete(self, *args, **kwargs):
-        #Delete the image when the post is deleted
-        self.img.delete(save=False)
-        super().delete(*args, **kwargs)
+        from . import images, tasks
+        with transaction.atomic(using=kwargs.get('using')):
+            #Delete the image when the post is deleted, once that's committed
+            if self.img:
+                tasks.enqueue('blog.delete_files', images.stored_files(self.img.name, self.img_variants))
+            return super().delete(*args, **kwargs)
+
+    class Meta:
+        #the keyset pagination seeks on (ordering field, id), see blog.pagination
+        indexes = [
+            models.Index(fields=['safe', 'id'], name='blog_post_safe_idx'),
+            models.Index(fields=['-safe', 'id'], name='blog_post_safe_desc_idx'),
+            models.Index(fields=['title', 'id'], name='blog_post_title_idx'),
+            models.Index(fields=['-title', 'id'], name='blog_post_title_desc_idx'),
+            models.Index(fields=['created_at', 'id'], name='blog_post_created_idx'),
+            #the safe feed, the one most lists go through
+            models.Index(fields=['id'], condition=Q(safe=True), name='blog_post_safe_feed_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if self.pk:
-            #Look for the original image
-            original = Post.objects.get(pk=self.pk)
+        from . import images, tasks
+        old_files, image_changed = [], self._state.adding and bool(self.img)
+        if not self._state.adding and 'img' in (kwargs.get('update_fields') or self.changed_fields()):
+            #Look for the original image, only when this save may replace it
+            original = Post.objects.filter(pk=self.pk).values('img', 'img_variants').first() or {}
+            image_changed = original.get('img') != self.img.name
             #If the original image is different from the new one, delete the original image
-            if original.img and original.img != self.img:
-                original.img.delete(save=False)
-        super().save(*args, **kwargs)
+            if original.get('img') and image_changed:
+                old_files = images.stored_files(original['img'], original['img_variants'])
+        if not image_changed:
+            return super().save(*args, **kwargs)
+        #The file work is queued in the same transaction, see blog.tasks
+        with transaction.atomic(using=kwargs.get('using')):
+            if old_files:
+                tasks.enqueue('blog.delete_files', old_files)
+            super().save(*args, **kwargs)
+            if self.img:
+                tasks.enqueue('blog.process_image', self.pk, self.img.name)
 
-class Comment(models.Model):
+class Comment(ChangeTrackingMixin, models.Model):
     body = models.CharField(max_length=255,null=False,blank=False)
     author = models.ForeignKey(User,on_delete=models.SET_NULL, null=True)
     post = models.ForeignKey(Post,on_delete=models.CASCADE, null=False)
     created_at = models.DateTimeField(auto_now_add=True,editable=False)
     likes = GenericRelation(Like)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    counter_fields = ('like_count',)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created_at', 'id'], name='blog_comment_post_idx'),
+        ]
 
     def __str__(self):
         return self.body
     
+class TableCount(models.Model):
+    #Row counts of the big tables, see blog.counts: BLOG_COUNT_SLOTS rows per table, a write bumps
+    #one of them and a read sums them, so concurrent writers don't queue on a single row lock
+    table = models.CharField(max_length=100)
+    slot = models.PositiveSmallIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+    counted_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.table}[{self.slot}]: {self.count}'
+
+    class Meta:
+        unique_together = ('table', 'slot')
+
+class Task(models.Model):
+    #A deferred call of a blog.tasks function, run by manage.py run_tasks
+    PENDING, RUNNING, FAILED = 'pending', 'running', 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    #a running task whose lease ran out belongs to a dead worker and is picked up again
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='blog_task_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}{tuple(self.args)} {self.status}'
+
+class UserTagManager(models.Manager):
+    def tag_batch(self, post_id, user_ids):
+        #One INSERT ... ON CONFLICT DO NOTHING for all the users, the unique (user, post) skips the
+        #ones already tagged, plus the feed rows and the tag_count refresh. Bypasses the UserTag signals,
+        #the caller bumps the response cache. Returns the post's tag_count.
+        from . import counters, feed
+        with transaction.atomic(using=self.db):
+            self.bulk_create([UserTag(user_id=user_id, post_id=post_id) for user_id in user_ids],
+                             ignore_conflicts=True)
+            feed.add(f't.post_id = %s AND t.user_id IN ({", ".join(["%s"] * len(user_ids))})',
+                     [post_id, *user_ids], self.db)
+            counters.refresh(Post, 'tag_count', counters.tags_subquery(), [post_id])
+            return Post.objects.filter(pk=post_id).values_list('tag_count', flat=True).get()
+
 class UserTag(models.Model):
     user = models.ForeignKey(User,on_delete=models.CASCADE, null=False)
     post = models.ForeignKey(Post,on_delete=models.CASCADE, null=False)
     created_at = models.DateTimeField(auto_now_add=True,editable=False)
 
+    objects = UserTagManager()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            #last_tag_date is an index-only MAX per post
+            models.Index(fields=['post', 'created_at'], name='blog_usertag_post_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.user.pk) + ' tagged to ' + str(self.post.pk)
+
+class TaggedPost(models.Model):
+    #The tagged-posts feed: a copy of every UserTag with its post's title, so a user's page is one
+    #index range scan that never touches blog_post. Kept in sync by blog.feed.
+    #The unique (user, post) index covers the lookups by user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    post_title = models.CharField(max_length=100)
+    #when the user was tagged
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            #newest first, the keyset pagination seeks on (created_at, id)
+            models.Index(fields=['user', 'created_at', 'id'], name='blog_taggedpost_feed_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.user_id) + ' tagged in ' + str(self.post_id)
+
+class RequestProfile(models.Model):
+    #A cProfile capture of one request, see blog.profiling
+    SAMPLED, REQUESTED = 'sampled', 'requested'
+    TRIGGER_CHOICES = [(SAMPLED, 'Sampled'), (REQUESTED, 'Requested')]
+
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status_code = models.PositiveSmallIntegerField()
+    #ms
+    duration = models.FloatField()
+    queries = models.PositiveIntegerField(default=0)
+    #ms per Server-Timing phase, the queries left out
+    timings = models.JSONField(default=dict)
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    #zlib compressed pstats data, see stats_file()
+    stats = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+
+    def stats_file(self):
+        #What cProfile's dump_stats writes, for pstats, snakeviz and the like
+        return zlib.decompress(self.stats)
+
     def __str__(self):
-        return str(self.user.pk) + ' tagged to ' + str(self.post.pk)
\ No newline at end of file
+        return f'{self.method} {self.path} {self.duration:.0f}ms'
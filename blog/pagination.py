@@ -0,0 +1,177 @@
+from rest_framework.pagination import BasePagination
+from asgiref.sync import sync_to_async
+from rest_framework.utils.urls import replace_query_param
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from collections import OrderedDict
+from django.db.models import Q
+from blog.encoders import JSONEncoder
+from blog import counts
+import base64
+import json
+
+
+class KeysetPagination(BasePagination):
+    #Seeks to the page with WHERE (ordering fields, pk) > last row instead of OFFSET,
+    #and never runs a COUNT(*). Follows whatever ordering the filters left on the queryset.
+    #?count=true adds a total, from blog.counts when the list isn't filtered.
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def page_queryset(self, queryset, request):
+        #The unevaluated page, plus one row to tell whether there is a next one
+        ordering = self.get_ordering(queryset)
+        position, reverse = self.decode_cursor(request)
+        if position is not None and len(position) != len(ordering):
+            #A cursor from a different ordering
+            raise NotFound(self.invalid_cursor_message)
+        if position is not None:
+            position = self.to_python(queryset, ordering, position)
+
+        if reverse:
+            queryset = queryset.order_by(*[name if desc else '-' + name for name, desc in ordering])
+        else:
+            queryset = queryset.order_by(*['-' + name if desc else name for name, desc in ordering])
+        if position is not None:
+            queryset = queryset.filter(self.seek(ordering, position, reverse))
+        return queryset[:self.page_size + 1], ordering, position, reverse
+
+    def get_count(self, queryset, request):
+        #None unless asked for, computed once per request
+        if request.query_params.get(self.count_query_param) not in ('1', 'true'):
+            return None
+        if not hasattr(self, 'count'):
+            self.count = counts.queryset_count(queryset)
+        return self.count
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.get_count(queryset, request)
+        queryset, ordering, position, reverse = self.page_queryset(queryset, request)
+        return self.paginate_rows(list(queryset), ordering, position, reverse)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        #The same page read through the async queryset API, for blog.async_views
+        self.request = request
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            await sync_to_async(self.get_count)(queryset, request)
+        queryset, ordering, position, reverse = self.page_queryset(queryset, request)
+        return self.paginate_rows([row async for row in queryset], ordering, position, reverse)
+
+    def paginate_rows(self, rows, ordering, position, reverse):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.next_position = self.previous_position = None
+        if rows and (has_more if not reverse else position is not None):
+            self.next_position = self.position(rows[-1], ordering)
+        if rows and (has_more if reverse else position is not None):
+            self.previous_position = self.position(rows[0], ordering)
+        return rows
+
+    def get_ordering(self, queryset):
+        #[(field, descending)], always ending with the pk so the order is total
+        ordering = []
+        for item in queryset.query.order_by or queryset.model._meta.ordering or ['pk']:
+            if not isinstance(item, str):
+                raise ImproperlyConfigured('KeysetPagination only supports ordering by field names.')
+            ordering.append((item.lstrip('-'), item.startswith('-')))
+        pk_names = ('pk', queryset.model._meta.pk.name)
+        if not any(name in pk_names for name, desc in ordering):
+            ordering.append(('pk', False))
+        return ordering
+
+    def get_field(self, queryset, name):
+        #The model field or annotation an ordering name refers to
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model = queryset.model
+        for attr in name.split('__'):
+            field = model._meta.pk if attr == 'pk' else model._meta.get_field(attr)
+            model = field.related_model
+        return field
+
+    def to_python(self, queryset, ordering, position):
+        #The cursor's JSON values as the ordering fields' values, a tampered cursor is a 404 rather
+        #than a query that fails
+        try:
+            return [self.get_field(queryset, name).to_python(value) for (name, desc), value in zip(ordering, position)]
+        except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def seek(self, ordering, position, reverse):
+        #(a, b, pk) > (x, y, z) spelled out as OR-ed prefixes, which every backend can index
+        condition = Q()
+        for i, (name, desc) in enumerate(ordering):
+            prefix = {field: value for (field, _), value in zip(ordering[:i], position)}
+            lookup = 'lt' if desc != reverse else 'gt'
+            condition |= Q(**prefix, **{f'{name}__{lookup}': position[i]})
+        return condition
+
+    def position(self, row, ordering):
+        values = []
+        for name, desc in ordering:
+            value = row
+            for attr in name.split('__'):
+                value = getattr(value, attr)
+            values.append(value)
+        return values
+
+    def encode_cursor(self, position, reverse):
+        #Full microseconds, a seek on a cut timestamp would repeat rows
+        data = json.dumps({'p': position, 'r': reverse}, cls=JSONEncoder)
+        cursor = base64.urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            position, reverse = data['p'], data['r']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        #what position() encodes: a list of non-null scalars
+        if (not isinstance(position, list) or not isinstance(reverse, bool)
+                or not all(isinstance(value, (str, int, float)) for value in position)):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+        if getattr(self, 'count', None) is not None:
+            response['count'] = self.count
+            response.move_to_end('count', last=False)
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer', 'example': 123},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
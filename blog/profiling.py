@@ -0,0 +1,173 @@
+from django.conf import settings
+from django.urls import reverse
+from contextvars import ContextVar
+from contextlib import contextmanager
+import threading
+import base64
+import cProfile
+import logging
+import marshal
+import random
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+#Where a request's time goes, for the Server-Timing header of blog.middleware.ServerTimingMiddleware:
+#the views time authentication, serialization and rendering (ServerTimingMixin), the queries are
+#timed by blog.middleware.QueryCountMiddleware. A phase leaves out the queries run inside it, db has
+#them all, so the phases add up to the total and app is what's left (routing, filters, view code).
+#
+#cProfile captures the whole request for a BLOG_PROFILE_SAMPLE_RATE fraction of them, or from the
+#authentication on for staff asking with ?profile=1 or an X-Blog-Profile header, and keeps it as a
+#RequestProfile to download from /blog/api/profile. One request per process is profiled at a time,
+#the others aren't slowed down. The sampled profiles are stored by the task worker (manage.py run_tasks).
+#
+#The Server-Timing header goes to everyone with BLOG_SERVER_TIMING = True, to staff only with 'staff'.
+timings = ContextVar('blog_timings', default=None)
+PHASES = ('auth', 'serialize', 'render')
+#held by the request being profiled
+profiling = threading.Lock()
+
+
+class Timings:
+    def __init__(self, stats=None, can_profile=False):
+        self.start = time.perf_counter()
+        #the request's blog.middleware.QueryStats
+        self.stats = stats
+        self.phases = {}
+        self.can_profile = can_profile
+        self.profiler = None
+        self.trigger = None
+
+    def db_time(self):
+        return self.stats.time if self.stats is not None else 0.0
+
+    def begin(self):
+        return time.perf_counter(), self.db_time()
+
+    def end(self, name, begun):
+        started, db_time = begun
+        elapsed = time.perf_counter() - started - (self.db_time() - db_time)
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def start_profile(self, trigger):
+        if self.profiler is not None or not profiling.acquire(blocking=False):
+            return
+        self.profiler = cProfile.Profile()
+        self.trigger = trigger
+        self.profiler.enable()
+
+    def stop_profile(self):
+        self.profiler.disable()
+        profiling.release()
+
+    def header(self):
+        total = time.perf_counter() - self.start
+        entries = [(name, self.phases[name], None) for name in PHASES if name in self.phases]
+        if self.stats is not None:
+            entries.append(('db', self.stats.time, f'{self.stats.count} queries'))
+        entries.append(('app', max(total - sum(duration for name, duration, desc in entries), 0.0), None))
+        entries.append(('total', total, None))
+        return ', '.join(f'{name};dur={duration * 1000:.1f}' + (f';desc="{desc}"' if desc else '')
+                         for name, duration, desc in entries)
+
+def server_timing(request):
+    #Whether this request's client gets the Server-Timing header
+    if settings.BLOG_SERVER_TIMING == 'staff':
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+    return bool(settings.BLOG_SERVER_TIMING)
+
+@contextmanager
+def phase(name):
+    current = timings.get()
+    if current is None:
+        yield
+        return
+    begun = current.begin()
+    try:
+        yield
+    finally:
+        current.end(name, begun)
+
+def sampled():
+    rate = settings.BLOG_PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+def requested(request):
+    return bool(request.headers.get('X-Blog-Profile') or request.GET.get('profile'))
+
+def record(request, response, current):
+    #The RequestProfile fields, as JSON for the task queue
+    profiler = current.profiler
+    profiler.create_stats()
+    stats = current.stats
+    user = getattr(request, 'user', None)
+    return {
+        'method': request.method,
+        'path': request.get_full_path()[:255],
+        'user_id': user.pk if user is not None and user.is_authenticated else None,
+        'status_code': response.status_code,
+        'duration': (time.perf_counter() - current.start) * 1000,
+        'queries': stats.count if stats is not None else 0,
+        'timings': {name: round(duration * 1000, 3) for name, duration in current.phases.items()},
+        'trigger': current.trigger,
+        #the pstats format, what cProfile's dump_stats writes
+        'stats': base64.b64encode(zlib.compress(marshal.dumps(profiler.stats))).decode(),
+    }
+
+def save(fields):
+    from .models import RequestProfile
+    profile = RequestProfile.objects.create(**{**fields, 'stats': base64.b64decode(fields['stats'])})
+    #only the newest BLOG_PROFILE_KEEP
+    keep = settings.BLOG_PROFILE_KEEP
+    oldest = list(RequestProfile.objects.order_by('-pk').values_list('pk', flat=True)[keep:keep + 1])
+    if oldest:
+        RequestProfile.objects.filter(pk__lte=oldest[0]).delete()
+    return profile
+
+def finish(request, response, current):
+    from . import tasks
+    current.stop_profile()
+    try:
+        fields = record(request, response, current)
+        if current.trigger == 'requested':
+            #staff asked for it, they get the link to it
+            profile = save(fields)
+            response['X-Blog-Profile'] = reverse('blog:profile-download', args=[profile.pk])
+        else:
+            #a sampled request only queues it, the task worker stores it and prunes the old ones
+            tasks.enqueue('blog.save_profile', fields)
+    except Exception:
+        #a lost profile mustn't fail the request
+        logger.warning('Could not save the profile of %s %s', request.method, request.path, exc_info=True)
+
+
+class ServerTimingMixin:
+    #Times the phases of an APIView for the Server-Timing header, and starts the profile staff ask for
+    def perform_authentication(self, request):
+        with phase('auth'):
+            super().perform_authentication(request)
+        current = timings.get()
+        if current is not None and current.can_profile and request.user.is_staff and requested(request):
+            current.start_profile('requested')
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        to_representation = serializer.to_representation
+
+        def timed(*args, **kwargs):
+            with phase('serialize'):
+                return to_representation(*args, **kwargs)
+        serializer.to_representation = timed
+        return serializer
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        current = timings.get()
+        #rendered by the handler once the view has returned
+        if current is not None and not getattr(response, 'is_rendered', True):
+            begun = current.begin()
+            response.add_post_render_callback(lambda response: current.end('render', begun))
+        return response
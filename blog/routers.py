@@ -0,0 +1,44 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.conf import settings
+from contextvars import ContextVar
+import random
+
+#Set by blog.middleware.ReplicaMiddleware for the requests whose reads may lag behind the primary.
+#Anything else (writes, management commands, the task worker, the shell) reads from the primary.
+replica_reads = ContextVar('blog_replica_reads', default=False)
+
+
+def wrote_recently(request):
+    #A client that wrote in the last BLOG_REPLICA_STICKY_SECONDS, see blog.middleware.stick_to_primary
+    return settings.BLOG_REPLICA_COOKIE in request.COOKIES
+
+def replicas_allowed():
+    #Not inside a transaction either, it has to see its own writes
+    return (replica_reads.get() and bool(settings.BLOG_READ_REPLICAS)
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block)
+
+class ReplicaRouter:
+    #The blog's reads go to a random BLOG_READ_REPLICAS alias when allowed, writes and migrations to
+    #the primary. Sessions and users stay on the primary, a login must work on the next request.
+    replicated_apps = ('blog',)
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in self.replicated_apps and replicas_allowed():
+            return random.choice(settings.BLOG_READ_REPLICAS)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        #the replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.BLOG_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        #replicas get the schema through replication
+        if db in settings.BLOG_READ_REPLICAS:
+            return False
+        return None
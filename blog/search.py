@@ -0,0 +1,101 @@
+from rest_framework.filters import OrderingFilter, SearchFilter
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.conf import settings
+from django.db import connections
+import re
+
+#Postgres keeps blog_post.search_vector up to date with triggers (migrations 0012 and 0022),
+#SQLite keeps the blog_post_fts FTS5 table up to date with triggers (install_sqlite_fts).
+#Both follow a change of the author's username too.
+SQLITE_FTS_TRIGGERS = ('blog_post_fts_insert', 'blog_post_fts_update', 'blog_post_fts_delete', 'blog_post_fts_author')
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS blog_post_fts USING fts5(title, body, author, "
+    "tokenize = 'unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS blog_post_fts_insert AFTER INSERT ON blog_post BEGIN "
+    "INSERT INTO blog_post_fts(rowid, title, body, author) VALUES (new.id, new.title, new.body, "
+    "(SELECT username FROM auth_user WHERE id = new.author_id)); END",
+    "CREATE TRIGGER IF NOT EXISTS blog_post_fts_update AFTER UPDATE OF title, body, author_id ON blog_post BEGIN "
+    "UPDATE blog_post_fts SET title = new.title, body = new.body, "
+    "author = (SELECT username FROM auth_user WHERE id = new.author_id) WHERE rowid = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS blog_post_fts_delete AFTER DELETE ON blog_post BEGIN "
+    "DELETE FROM blog_post_fts WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS blog_post_fts_author AFTER UPDATE OF username ON auth_user BEGIN "
+    "UPDATE blog_post_fts SET author = new.username WHERE rowid IN "
+    "(SELECT id FROM blog_post WHERE author_id = new.id); END",
+]
+
+
+def install_sqlite_fts(using='default', **kwargs):
+    #SQLite drops the triggers whenever a migration rebuilds blog_post, so this runs after every migrate
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or 'blog_post' not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN "
+                       f"({', '.join(['%s'] * len(SQLITE_FTS_TRIGGERS))})", SQLITE_FTS_TRIGGERS)
+        if cursor.fetchone()[0] == len(SQLITE_FTS_TRIGGERS):
+            return
+        for statement in SQLITE_FTS:
+            cursor.execute(statement)
+        cursor.execute("DELETE FROM blog_post_fts")
+        cursor.execute("INSERT INTO blog_post_fts(rowid, title, body, author) "
+                       "SELECT p.id, p.title, p.body, u.username FROM blog_post p "
+                       "LEFT JOIN auth_user u ON u.id = p.author_id")
+
+def drop_sqlite_fts_triggers(using='default'):
+    #For bulk loads: install_sqlite_fts puts them back and reindexes every post in one statement
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name in SQLITE_FTS_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+def search_words(terms):
+    return [word.lower() for term in terms for word in re.findall(r'\w+', term)]
+
+def fulltext_search(queryset, terms):
+    #Every word must match, as a prefix; adds a search_rank annotation, higher is better
+    words = search_words(terms)
+    if not words:
+        return queryset
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    if connection.vendor == 'postgresql':
+        query = ' & '.join(f'{word}:*' for word in words)
+        matches = RawSQL(f"SELECT id FROM {table} WHERE search_vector @@ to_tsquery('simple', %s)", [query])
+        #ts_rank is a real, the keyset cursor seeks on it as a double precision: cast it so the
+        #values compare equal
+        rank = RawSQL(f"ts_rank({table}.search_vector, to_tsquery('simple', %s))::double precision", [query],
+                      output_field=FloatField())
+    else:
+        query = ' '.join(f'"{word}"*' for word in words)
+        matches = RawSQL("SELECT rowid FROM blog_post_fts WHERE blog_post_fts MATCH %s", [query])
+        rank = RawSQL(f"(SELECT -rank FROM blog_post_fts WHERE blog_post_fts MATCH %s AND rowid = {table}.id)",
+                      [query], output_field=FloatField())
+    return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+class PostSearchFilter(SearchFilter):
+    #?search_mode=fulltext uses the full-text index, substring keeps the icontains search
+    search_mode_param = 'search_mode'
+    ordering_params = (OrderingFilter.ordering_param, 'orderings')
+
+    def construct_search(self, field_name):
+        #The plain substring search goes through the trigram indexes too
+        lookup = super().construct_search(field_name)
+        if lookup.endswith('__icontains'):
+            lookup = lookup[:-len('icontains')] + 'trgm_icontains'
+        return lookup
+
+    def filter_queryset(self, request, queryset, view):
+        mode = request.query_params.get(self.search_mode_param, settings.BLOG_SEARCH_MODE)
+        if mode != 'fulltext':
+            return super().filter_queryset(request, queryset, view)
+        terms = self.get_search_terms(request)
+        if not search_words(terms):
+            return queryset
+        queryset = fulltext_search(queryset, terms)
+        if not any(param in request.query_params for param in self.ordering_params):
+            queryset = queryset.order_by('-search_rank')
+        return queryset
@@ -0,0 +1,100 @@
+from django.contrib.auth.models import User
+from django.db.models import Max
+from django.utils import timezone
+from .models import Post, Comment, Like, UserTag
+from datetime import timedelta
+import itertools
+import bisect
+
+#Synthetic blog data in the blog.export record format, for manage.py seed_blog to bulk load.
+#Who writes and what gets attention follow a power law: user (or post) of rank r is picked with a
+#weight of 1 / r ** skew, so a few authors write most posts and a few hot posts collect most of
+#the comments, likes and tags. Deterministic for a given random.Random seed.
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut '
+         'labore et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris '
+         'nisi aliquip ex ea commodo consequat duis aute irure in reprehenderit voluptate velit esse '
+         'cillum fugiat nulla pariatur excepteur sint occaecat cupidatat non proident').split()
+
+
+class PowerLaw:
+    def __init__(self, rng, values, skew):
+        self.rng = rng
+        self.values = values
+        self.cum_weights = list(itertools.accumulate(1 / rank ** skew for rank in range(1, len(values) + 1)))
+
+    def pick(self):
+        position = self.rng.random() * self.cum_weights[-1]
+        return self.values[min(bisect.bisect(self.cum_weights, position), len(self.values) - 1)]
+
+def text(rng, low, high, limit):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high)))[:limit].strip()
+
+def timestamp(value):
+    return value.isoformat()
+
+def unique_pairs(pick, count):
+    #Up to count distinct picks, a power law repeats itself a lot near the top
+    pairs = set()
+    for attempt in range(count * 5):
+        if len(pairs) == count:
+            break
+        pairs.add(pick())
+    return pairs
+
+def first_ids(using='default'):
+    #New rows go after the existing ones
+    return {name: (model.objects.using(using).aggregate(last=Max('pk'))['last'] or 0) + 1
+            for name, model in (('user', User), ('post', Post), ('comment', Comment),
+                                ('like', Like), ('usertag', UserTag))}
+
+def usernames(start, users):
+    return [f'seed{start["user"] + i}' for i in range(users)]
+
+def records(rng, usernames, posts, comments, likes, tags, skew=1.1, days=365, start=None):
+    #(type, record) for the blog.importer Loader, posts before what refers to them
+    start = start or first_ids()
+    now = timezone.now()
+    first_day = now - timedelta(days=days)
+    #authors by rank, the power law favours the first ones
+    authors = PowerLaw(rng, usernames, skew)
+    post_ids = list(range(start['post'], start['post'] + posts))
+    post_times = {}
+    for i, pk in enumerate(post_ids):
+        #spread over the period, newer ids are newer posts
+        post_times[pk] = first_day + timedelta(days=days) * (i + rng.random()) / posts
+        yield 'post', {'id': pk, 'title': text(rng, 2, 8, 100), 'body': text(rng, 10, 40, 255),
+                       'author': authors.pick(), 'created_at': timestamp(post_times[pk]),
+                       'safe': rng.random() < 0.9}
+    if not post_ids:
+        return
+    #hot posts are any posts, not the oldest
+    ranked_posts = post_ids[:]
+    rng.shuffle(ranked_posts)
+    hot_posts = PowerLaw(rng, ranked_posts, skew)
+
+    def after(created_at):
+        return timestamp(created_at + (now - created_at) * rng.random())
+
+    comment_ids = list(range(start['comment'], start['comment'] + comments))
+    for pk in comment_ids:
+        post = hot_posts.pick()
+        yield 'comment', {'id': pk, 'post_id': post, 'body': text(rng, 3, 30, 255),
+                          'author': authors.pick(), 'created_at': after(post_times[post])}
+
+    #likes: three in four on posts, the rest on comments
+    hot_comments = PowerLaw(rng, comment_ids, skew) if comment_ids else None
+    likers = PowerLaw(rng, usernames[::-1], skew * 0.5)
+
+    def like():
+        if hot_comments is None or rng.random() < 0.75:
+            return likers.pick(), 'post', hot_posts.pick()
+        return likers.pick(), 'comment', hot_comments.pick()
+    for pk, (user, content_type, object_id) in enumerate(sorted(unique_pairs(like, likes)), start['like']):
+        yield 'like', {'id': pk, 'user': user, 'content_type': content_type, 'object_id': object_id,
+                       'created_at': timestamp(now)}
+
+    #tags: heavy users get tagged in a lot of posts
+    tagged = PowerLaw(rng, usernames, skew)
+    for pk, (user, post) in enumerate(sorted(unique_pairs(lambda: (tagged.pick(), hot_posts.pick()), tags)),
+                                      start['usertag']):
+        yield 'usertag', {'id': pk, 'user': user, 'post_id': post, 'created_at': after(post_times[post])}
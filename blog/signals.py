@@ -0,0 +1,97 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_delete, post_save
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+from .models import Post, Comment, UserTag, Like
+from . import cache, counters, counts, feed
+
+
+#Keep the denormalized counters in sync, cascades and queryset deletes included
+@receiver(post_save, sender=Like)
+def like_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_like_count(instance.content_type_id, instance.object_id, 1)
+
+@receiver(post_delete, sender=Like)
+def like_deleted(sender, instance, **kwargs):
+    counters.bump_like_count(instance.content_type_id, instance.object_id, -1)
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump(Post, instance.post_id, 'comment_count', 1)
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.bump(Post, instance.post_id, 'comment_count', -1)
+
+@receiver(post_save, sender=UserTag)
+def usertag_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump(Post, instance.post_id, 'tag_count', 1)
+
+@receiver(post_delete, sender=UserTag)
+def usertag_deleted(sender, instance, **kwargs):
+    counters.bump(Post, instance.post_id, 'tag_count', -1)
+
+#Keep the tagged-posts feed in sync
+@receiver(post_save, sender=UserTag)
+def usertag_feed_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feed.tagged(instance)
+
+@receiver(post_delete, sender=UserTag)
+def usertag_feed_deleted(sender, instance, **kwargs):
+    feed.untagged(instance)
+
+@receiver(post_save, sender=Post)
+def post_feed_retitled(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if not created and not raw and (update_fields is None or 'title' in update_fields):
+        feed.retitled(instance)
+
+#Keep the table row counts in sync
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+def row_created(sender, instance, created, **kwargs):
+    if created:
+        counts.bump(sender, 1)
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+def row_deleted(sender, instance, **kwargs):
+    counts.bump(sender, -1)
+
+
+#Bump the response cache versions of whatever the write shows up in
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, update_fields=None, **kwargs):
+    cache.post_changed(instance.pk)
+    #comments and tagged posts show the post's title
+    if update_fields is None or 'title' in update_fields:
+        cache.bump('comments', 'titles')
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    cache.comment_changed(instance.pk)
+    cache.post_changed(instance.post_id)
+
+@receiver(post_save, sender=UserTag)
+@receiver(post_delete, sender=UserTag)
+def usertag_changed(sender, instance, **kwargs):
+    cache.bump('tags')
+    cache.post_changed(instance.post_id)
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def like_changed(sender, instance, **kwargs):
+    model = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+    if model is not None:
+        cache.likes_changed(model, [instance.object_id])
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    #usernames show up everywhere, logging in only touches last_login
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        cache.bump('posts', 'comments', 'tags', 'users')
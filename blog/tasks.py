@@ -0,0 +1,87 @@
+from django.db.models import F, Q
+from django.utils import timezone
+from django.conf import settings
+from datetime import timedelta
+from .models import Post, Task
+from . import images, profiling
+import traceback
+import logging
+
+logger = logging.getLogger(__name__)
+
+#name -> function, filled by @task
+REGISTRY = {}
+
+
+def task(name):
+    def register(func):
+        REGISTRY[name] = func
+        return func
+    return register
+
+def enqueue(name, *args, delay=0):
+    #A row in the caller's transaction: workers only see it once the change that needs it
+    #is committed, and a rollback takes it back along with the change
+    if name not in REGISTRY:
+        raise LookupError(f'Unknown task {name}')
+    return Task.objects.create(name=name, args=list(args), run_at=timezone.now() + timedelta(seconds=delay))
+
+def due(now):
+    #Pending ones whose time has come, and running ones a dead worker left behind
+    return Q(status=Task.PENDING, run_at__lte=now) | Q(status=Task.RUNNING, locked_until__lt=now)
+
+def claim(limit):
+    now = timezone.now()
+    claimed = []
+    for pk in Task.objects.filter(due(now)).order_by('run_at').values_list('pk', flat=True)[:limit]:
+        #Only one worker's conditional UPDATE matches, no SELECT ... FOR UPDATE needed
+        if Task.objects.filter(due(now), pk=pk).update(
+                status=Task.RUNNING, attempts=F('attempts') + 1,
+                locked_until=now + timedelta(seconds=settings.BLOG_TASK_LEASE)):
+            claimed.append(pk)
+    return list(Task.objects.filter(pk__in=claimed).order_by('run_at'))
+
+def backoff(attempts):
+    return min(settings.BLOG_TASK_RETRY_DELAY * 2 ** (attempts - 1), settings.BLOG_TASK_MAX_RETRY_DELAY)
+
+def owned(task):
+    #The task as long as this worker's lease holds: once it ran out and another worker claimed it,
+    #that worker's locked_until is on the row and these updates match nothing
+    return Task.objects.filter(pk=task.pk, status=Task.RUNNING, locked_until=task.locked_until)
+
+def run(task):
+    try:
+        if task.name not in REGISTRY:
+            raise LookupError(f'Unknown task {task.name}')
+        REGISTRY[task.name](*task.args)
+    except Exception:
+        error = traceback.format_exc()
+        if task.attempts >= settings.BLOG_TASK_MAX_ATTEMPTS:
+            logger.error('Task %s failed for good: %s', task, error)
+            owned(task).update(status=Task.FAILED, locked_until=None, last_error=error)
+        else:
+            run_at = timezone.now() + timedelta(seconds=backoff(task.attempts))
+            owned(task).update(status=Task.PENDING, run_at=run_at, locked_until=None, last_error=error)
+        return False
+    owned(task).delete()
+    return True
+
+def run_pending(limit=100):
+    #Runs the due tasks in this thread, returns how many succeeded
+    return sum(run(task) for task in claim(limit))
+
+
+@task('blog.delete_files')
+def delete_files(names):
+    storage = Post._meta.get_field('img').storage
+    for name in names:
+        #a no-op for files that are already gone, so retries are safe
+        storage.delete(name)
+
+@task('blog.process_image')
+def process_image(pk, name):
+    images.process(pk, name)
+
+@task('blog.save_profile')
+def save_profile(fields):
+    profiling.save(fields)
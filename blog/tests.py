@@ -1,18 +1,40 @@
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.db.utils import DataError, IntegrityError
+from django.db.utils import DatabaseError, DataError, IntegrityError
 from django.core.exceptions import ValidationError
-from .models import Post, Comment, UserTag, Like
+from django.core.management import CommandError, call_command
+from .models import Post, Comment, UserTag, Like, TableCount, Task, TaggedPost, RequestProfile
+from .pagination import KeysetPagination
+from .middleware import ReplicaMiddleware
+from .checks import check_response_cache
+from .views import PostViewSet, CommentViewSet, PostCommentViewSet
+from . import counts, export, feed, images, importer, profiling, routers, tasks
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
-from django.db import transaction
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+from rest_framework.mixins import ListModelMixin
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, router, transaction
+from django.http import HttpResponse
+from asgiref.sync import async_to_sync
+from django.db.models.signals import post_save
 from dateutil.parser import parse
-from django.test import TestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.conf import settings
 from django.urls import reverse
-from django.db.models import Q
+from django.utils import timezone
+from django.utils.http import http_date
+from datetime import timedelta
+from django.db.models import Count, Q
+from unittest import mock
+from io import BytesIO, StringIO
+from PIL import Image
+import base64
+import json
+import csv
 import tempfile
+import pstats
 import pytest
 import shutil
+import time
 import os
 
 # Create your tests here.
@@ -100,8 +122,10 @@ class PostTestCase(TestCase):
 
         path = post.img.path
 
-        #delete the post
+        #delete the post, the file goes with the queued task
         post.delete()
+        self.assertTrue(os.path.exists(path))
+        tasks.run_pending()
 
         #check if the image was deleted
         self.assertFalse(os.path.exists(path))
@@ -131,7 +155,8 @@ class PostTestCase(TestCase):
         #check if the image exists
         self.assertTrue(os.path.exists(post.img.path))
 
-        #check if the old image was deleted
+        #check if the old image was deleted by the queued task
+        tasks.run_pending()
         self.assertFalse(os.path.exists(post.img.path.replace("test_update_2.jpg", "test_update_1.jpg")))
 
     def test_post_comments_count(self):
@@ -240,6 +265,54 @@ class LikeTestCase(TestCase):
             with transaction.atomic():
                 Like.objects.create(user=self.user[0], content_object=self.comment).full_clean()
 
+@pytest.mark.django_db
+class CounterTestCase(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"counter{i}", password="testpassword")
+                      for i in range(3)]
+        self.post = Post.objects.create(title="test1", body="test1", author=self.users[0])
+
+    def test_counters_follow_writes(self):
+        comment = Comment.objects.create(body="test1", author=self.users[0], post=self.post)
+        for user in self.users:
+            Like.objects.create(user=user, content_object=self.post)
+            Like.objects.create(user=user, content_object=comment)
+            UserTag.objects.create(user=user, post=self.post)
+
+        #Check if the counters are updated on create
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count, self.post.tag_count), (3, 1, 3))
+        self.assertEqual(comment.like_count, 3)
+
+        #Check if the counters are updated on queryset and cascade deletes
+        Like.objects.filter(user=self.users[0]).delete()
+        self.users[1].delete()
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count, self.post.tag_count), (1, 1, 2))
+        self.assertEqual(comment.like_count, 1)
+
+        #Check a stale save doesn't overwrite the counters
+        stale = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(body="test2", author=self.users[0], post=self.post)
+        stale.title = "changed"
+        stale.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+
+    def test_reconcile_counters(self):
+        Comment.objects.create(body="test1", author=self.users[0], post=self.post)
+        Like.objects.create(user=self.users[0], content_object=self.post)
+        Post.objects.filter(pk=self.post.pk).update(like_count=7, comment_count=0)
+
+        call_command('reconcile_counters', chunk_size=1, stdout=StringIO())
+
+        #Check if the drifted counters were repaired
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (1, 1))
+
 @pytest.mark.django_db
 class UserLogSignTest(TestCase):
     def setUp(self):
@@ -318,7 +391,7 @@ class PostAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = Post.objects.count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
         #Creating new posts
         Post.objects.create(title="test1", body="test1", author=self.user)
@@ -333,7 +406,28 @@ class PostAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = Post.objects.count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
+
+    def test_post_list_stats_queries(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+
+        #Creating posts with comments and tags
+        for i in range(5):
+            post = Post.objects.create(title=f"stats{i}", body="stats", author=self.user)
+            Comment.objects.create(body="stats", author=self.user, post=post)
+            UserTag.objects.create(user=self.user, post=post)
+
+        #Checking the stats don't cost one query per row, the other query reads the ETag rows
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('blog:post-list'))
+
+        #Checking if the response is the same as the database
+        for data in response.data['results']:
+            post = Post.objects.get(title=data['title'])
+            self.assertEqual(post.comments_count, data['comments_count'])
+            self.assertEqual(post.tagged_count, data['tagged_count'])
+            self.assertEqual(post.last_tag_date, data['last_tag_date'])
 
     def test_post_create(self):
         #Force authentication
@@ -471,7 +565,7 @@ class CommentAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = Comment.objects.count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
         #Creating new comments
         Comment.objects.create(body="test1", post=self.post, author=self.user)
@@ -486,7 +580,60 @@ class CommentAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = Comment.objects.count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
+
+    def test_comment_list_queries(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+
+        #Creating comments by different authors on different posts
+        for i in range(5):
+            author = User.objects.create_user(username=f"author{i}", password="testpassword")
+            post = Post.objects.create(title=f"post{i}", body="post", author=author)
+            Comment.objects.create(body=f"comment{i}", post=post, author=author)
+
+        #Checking the authors and posts don't cost a query per comment, the other query reads the ETag rows
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('blog:comment-list'))
+        self.assertEqual(len(response.data['results']), 6)
+        for data in response.data['results']:
+            comment = Comment.objects.get(body=data['body'])
+            self.assertEqual(data['author'], comment.author.username)
+            self.assertEqual(data['post'], {'title': comment.post.title, 'pk': comment.post.pk})
+
+    def test_post_comments(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+        other = Post.objects.create(title="other", body="other", author=self.user)
+        Comment.objects.create(body="other", post=other, author=self.user)
+        #Comments created out of pk order
+        now = timezone.now()
+        for i in range(5):
+            comment = Comment.objects.create(body=f"test{i}", post=self.post, author=self.user)
+            Comment.objects.filter(pk=comment.pk).update(created_at=now - timedelta(minutes=i))
+        expected = list(Comment.objects.filter(post=self.post).order_by('created_at', 'pk').values_list('body', flat=True))
+
+        #Getting the post's comments oldest first, a page at a time
+        url = reverse('blog:post-comments-list', kwargs={'post_pk': self.post.pk})
+        bodies = []
+        with mock.patch.object(KeysetPagination, 'page_size', 4):
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            bodies += [data['body'] for data in response.data['results']]
+            response = self.client.get(response.data['next'])
+            bodies += [data['body'] for data in response.data['results']]
+        self.assertEqual(bodies, expected)
+        self.assertIsNone(response.data['next'])
+
+        #Checking a post without comments lists nothing, a missing post is a 404
+        empty = Post.objects.create(title="empty", body="empty", author=self.user)
+        response = self.client.get(reverse('blog:post-comments-list', kwargs={'post_pk': empty.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        url = reverse('blog:post-comments-list', kwargs={'post_pk': empty.pk + 100})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 404)
 
     def test_comment_create(self):
         #Force authentication
@@ -576,6 +723,53 @@ class UserTagAPITest(APITestCase):
         self.assertEqual(usertag.user.pk, response.data['user'])
         self.assertEqual(usertag.post.pk, response.data['post'])
 
+        #Checking a user can't be tagged twice on a post
+        response = self.client.post(reverse('blog:usertag-list'),{
+            'user': self.users[1].pk,
+            'post': self.posts[0].pk
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UserTag.objects.filter(user=self.users[1], post=self.posts[0]).count(), 1)
+
+    def test_usertag_batch(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.users[0])
+        UserTag.objects.create(user=self.users[1], post=self.posts[0])
+        users = [user.pk for user in self.users[1:]]
+
+        #Tagging many users is a fixed number of queries, already tagged and repeated users are skipped
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('blog:usertag-batch'), {
+                'post': self.posts[0].pk,
+                'users': users + users[:2],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertLessEqual(len(queries), 8)
+        self.assertEqual(response.data['users'], users)
+        self.assertEqual(response.data['tagged_count'], 4)
+
+        #Checking if the response is the same as the database
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].tag_count, 4)
+        self.assertEqual(set(self.posts[0].tagged_users.values_list('pk', flat=True)), set(users))
+
+        #Checking an unknown user rejects the whole batch
+        response = self.client.post(reverse('blog:usertag-batch'), {
+            'post': self.posts[1].pk,
+            'users': [self.users[1].pk, users[-1] + 100],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('users', response.data)
+        self.assertFalse(UserTag.objects.filter(post=self.posts[1]).exists())
+
+        #Checking an unknown post is rejected
+        response = self.client.post(reverse('blog:usertag-batch'), {
+            'post': self.posts[-1].pk + 100,
+            'users': users,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('post', response.data)
+
     def test_usertag_users(self):
         #Force authentication
         self.client.force_authenticate(user=self.users[0])
@@ -590,7 +784,7 @@ class UserTagAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = UserTag.objects.count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
         #Creating new usertags
         UserTag.objects.create(user=self.users[2], post=self.posts[0])
@@ -605,7 +799,7 @@ class UserTagAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = UserTag.objects.count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
     def test_usertag_posts(self):
         #Force authentication
@@ -621,7 +815,7 @@ class UserTagAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = UserTag.objects.filter(user=self.users[1]).count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
         #Creating new usertags
         UserTag.objects.create(user=self.users[1], post=self.posts[2])
@@ -636,7 +830,94 @@ class UserTagAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = UserTag.objects.filter(user=self.users[1]).count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
+
+@pytest.mark.django_db
+class TaggedPostFeedTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.posts = [Post.objects.create(title=f"test{i}", body="test", author=self.user) for i in range(5)]
+
+    def feed(self, user):
+        return list(TaggedPost.objects.filter(user=user).order_by('post').values_list('post', 'post_title'))
+
+    def test_feed_follows_tags(self):
+        #Checking tags add and remove feed rows
+        tag = UserTag.objects.create(user=self.other, post=self.posts[0])
+        UserTag.objects.create(user=self.other, post=self.posts[1])
+        self.assertEqual(self.feed(self.other), [(self.posts[0].pk, 'test0'), (self.posts[1].pk, 'test1')])
+        self.assertEqual(TaggedPost.objects.get(post=self.posts[0]).created_at, tag.created_at)
+        tag.delete()
+        self.assertEqual(self.feed(self.other), [(self.posts[1].pk, 'test1')])
+
+        #Checking a new title is copied to the feed, other changes don't touch it
+        self.posts[1].title = 'renamed'
+        self.posts[1].save()
+        self.assertEqual(self.feed(self.other), [(self.posts[1].pk, 'renamed')])
+        self.posts[1].body = 'changed'
+        with CaptureQueriesContext(connection) as queries:
+            self.posts[1].save()
+        self.assertFalse(any('blog_taggedpost' in query['sql'] for query in queries.captured_queries))
+
+        #Checking bulk tags are added
+        UserTag.objects.tag_batch(self.posts[2].pk, [self.user.pk, self.other.pk])
+        self.assertEqual(self.feed(self.user), [(self.posts[2].pk, 'test2')])
+        self.assertEqual(len(self.feed(self.other)), 2)
+
+        #Checking deleted posts and users leave the feed, and a rebuild gets back to the tags
+        self.posts[2].delete()
+        self.assertEqual(self.feed(self.other), [(self.posts[1].pk, 'renamed')])
+        TaggedPost.objects.all().delete()
+        feed.rebuild()
+        self.assertEqual(self.feed(self.other), [(self.posts[1].pk, 'renamed')])
+        self.other.delete()
+        self.assertFalse(TaggedPost.objects.exists())
+
+    def test_tagged_posts_endpoint(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+        #Tags made out of post order
+        now = timezone.now()
+        for i, post in enumerate(self.posts):
+            UserTag.objects.create(user=self.other, post=post)
+            TaggedPost.objects.filter(post=post).update(created_at=now - timedelta(minutes=(i * 2) % 5))
+        expected = [tag.post_id for tag in TaggedPost.objects.order_by('-created_at', '-pk')]
+
+        #Getting the tagged posts newest first, a page at a time, without reading blog_post
+        url = reverse('blog:post-tagged-posts', kwargs={'pk': self.other.pk})
+        pks = []
+        with mock.patch.object(KeysetPagination, 'page_size', 3):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(len(queries), 2)
+            self.assertFalse(any('blog_post"' in query['sql'] for query in queries.captured_queries))
+            pks += [data['pk'] for data in response.data['results']]
+            response = self.client.get(response.data['next'])
+            pks += [data['pk'] for data in response.data['results']]
+        self.assertEqual(pks, expected)
+        self.assertEqual(response.data['results'][-1]['title'], Post.objects.get(pk=pks[-1]).title)
+
+        #Checking a new title shows up
+        post = Post.objects.get(pk=expected[0])
+        post.title = 'renamed'
+        post.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['title'], 'renamed')
+
+        #Checking the post list's filters still apply, through blog_post and by pk as before the feed
+        Post.objects.filter(pk=self.posts[1].pk).update(safe=False)
+        safe = [post.pk for post in self.posts if post.pk != self.posts[1].pk]
+        response = self.client.get(url, {'safe': 'true'})
+        self.assertEqual([data['pk'] for data in response.data['results']], safe)
+        self.assertEqual(parse(response.data['results'][0]['tagged_at']),
+                         UserTag.objects.get(user=self.other, post=safe[0]).created_at)
+        titles = [data['title'] for data in self.client.get(url, {'ordering': '-title'}).data['results']]
+        self.assertEqual(titles, sorted(titles, reverse=True))
+        self.assertEqual(self.client.get(url, {'user': 'nobody'}).data['results'], [])
+        response = self.client.get(url, {'search': 'renamed'})
+        self.assertEqual([data['pk'] for data in response.data['results']], [expected[0]])
 
 @pytest.mark.django_db
 class PostFilteringAPITest(APITestCase):
@@ -671,7 +952,7 @@ class PostFilteringAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = Post.objects.filter(author=self.users[0]).count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
         #Getting the response from the API
         response = self.client.get(reverse('blog:post-list'),{
@@ -683,7 +964,7 @@ class PostFilteringAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = Post.objects.filter(author=self.users[4]).count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
 
         # FILTERING BY SAFE
@@ -698,7 +979,7 @@ class PostFilteringAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = Post.objects.filter(safe=True).count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
         #Getting the response from the API
         response = self.client.get(reverse('blog:post-list'),{
@@ -710,7 +991,7 @@ class PostFilteringAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = Post.objects.filter(safe=False).count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
 
         # FILTERING BY AUTHOR AND SAFE
@@ -726,7 +1007,7 @@ class PostFilteringAPITest(APITestCase):
 
         #Checking if the response is the same as the database
         count = Post.objects.filter(author=self.users[0], safe=True).count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
 
         #Getting the response from the API
         response = self.client.get(reverse('blog:post-list'),{
@@ -739,7 +1020,26 @@ class PostFilteringAPITest(APITestCase):
         
         #Checking if the response is the same as the database
         count = Post.objects.filter(author=self.users[4], safe=False).count()
-        self.assertEqual(count, response.data['count'])
+        self.assertEqual(count, len(response.data['results']))
+
+    def test_post_filter_substring(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.users[0])
+        User.objects.create_user(username="under_score", password="testpassword")
+
+        #Checking the trigram lookup matches like icontains, wildcards escaped
+        for term in ['ING', 'eo', 'r_s', '%', '_']:
+            self.assertEqual(list(User.objects.filter(username__trgm_icontains=term)),
+                             list(User.objects.filter(username__icontains=term)))
+
+        #Getting the response from the API
+        response = self.client.get(reverse('blog:post-list'),{
+            'user': 'EONA'
+        })
+
+        #Checking if the response is the same as the database
+        count = Post.objects.filter(author__username__icontains='EONA').count()
+        self.assertEqual(count, len(response.data['results']))
 
     def test_post_order(self):
         #Force authentication
@@ -934,6 +1234,33 @@ class LikeAPITest(APITestCase):
         #Checking if the response matches the database
         self.assertEqual(count, 1)
 
+    def test_like_toggle_count(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.users[0])
+
+        #Getting the response from the API for liking a post
+        response = self.client.post(reverse('blog:post-like', args=[self.posts[0].pk]))
+
+        #Checking if the response has the new like count
+        self.assertEqual(response.data, {'status': 'liked', 'likes': 1})
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).like_count, 1)
+
+        #Getting the response from the API for unliking the post
+        response = self.client.post(reverse('blog:post-like', args=[self.posts[0].pk]))
+
+        #Checking if the response has the new like count
+        self.assertEqual(response.data, {'status': 'unliked', 'likes': 0})
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).like_count, 0)
+
+        #Liking a missing post doesn't leave an orphan like
+        response = self.client.post(reverse('blog:post-like', args=[self.posts[1].pk + 100]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Like.objects.count(), 0)
+
+        #Checking an id past the bigint range is a 404 too, not a database error
+        response = self.client.post(reverse('blog:post-like', args=[2 ** 64]))
+        self.assertEqual(response.status_code, 404)
+
     def test_like_comment(self):
         #Force authentication
         self.client.force_authenticate(user=self.users[1])
@@ -981,4 +1308,1240 @@ class LikeAPITest(APITestCase):
         count = Like.objects.all().count()
 
         #Checking if the response matches the database
-        self.assertEqual(count, 1)
\ No newline at end of file
+        self.assertEqual(count, 1)
+
+    def test_like_batch(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.users[0])
+        Like.objects.create(user=self.users[0], content_object=self.comments[0])
+        Like.objects.create(user=self.users[1], content_object=self.comments[0])
+
+        #Getting the response from the API for a batch of likes and unlikes
+        response = self.client.post(reverse('blog:like-batch'), {'likes': [
+            {'content_type': 'post', 'object_id': self.posts[0].pk, 'liked': True},
+            {'content_type': 'post', 'object_id': self.posts[1].pk, 'liked': True},
+            {'content_type': 'post', 'object_id': self.posts[1].pk + 100, 'liked': True},
+            {'content_type': 'comment', 'object_id': self.comments[0].pk, 'liked': False},
+            {'content_type': 'comment', 'object_id': self.comments[1].pk, 'liked': False},
+        ]}, format='json')
+
+        #Checking if response is OK
+        self.assertEqual(response.status_code, 200)
+
+        #Checking if the response is the same as the database
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(response.data['missing'], [{'content_type': 'post', 'object_id': self.posts[1].pk + 100}])
+        for entry in response.data['results']:
+            model = Post if entry['content_type'] == 'post' else Comment
+            obj = model.objects.get(pk=entry['object_id'])
+            self.assertEqual(obj.likes.filter(user=self.users[0]).exists(), entry['liked'])
+            self.assertEqual(obj.likes.count(), entry['likes'])
+            self.assertEqual(obj.like_count, entry['likes'])
+        #Checking the other user's like is left alone
+        self.assertEqual(Like.objects.count(), 3)
+        self.assertTrue(self.comments[0].likes.filter(user=self.users[1]).exists())
+
+        #Checking an id past the column range is refused
+        response = self.client.post(reverse('blog:like-batch'), {'likes': [
+            {'content_type': 'post', 'object_id': 2 ** 64, 'liked': True}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+@pytest.mark.django_db
+class AuthenticationAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+
+    def test_token_auth(self):
+        #Getting a token from the API
+        response = self.client.post(reverse('blog:token'), {'username': 'testuser', 'password': 'testpassword'})
+
+        #Checking if response is OK
+        self.assertEqual(response.status_code, 200)
+        token = response.data['token']
+
+        #Checking if the token authenticates the user
+        response = self.client.get(reverse('blog:post-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+
+        #Checking if a tampered token is rejected
+        response = self.client.get(reverse('blog:post-list'), HTTP_AUTHORIZATION=f'Bearer {token}x')
+        self.assertEqual(response.status_code, 401)
+
+        #Checking if changing the password revokes the token
+        self.user.set_password('newpassword')
+        self.user.save()
+        response = self.client.get(reverse('blog:post-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_token_wrong_password(self):
+        response = self.client.post(reverse('blog:token'), {'username': 'testuser', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(BLOG_BASIC_AUTH_CACHE_TTL=60)
+    def test_cached_basic_auth(self):
+        credentials = base64.b64encode(b'testuser:testpassword').decode()
+
+        #Checking the password hasher only runs for the first request
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.verify', return_value=True) as verify:
+            for i in range(3):
+                response = self.client.get(reverse('blog:post-list'), HTTP_AUTHORIZATION=f'Basic {credentials}')
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(verify.call_count, 1)
+
+#bulk_create skips the signals that bump the response cache versions
+@override_settings(BLOG_RESPONSE_CACHE_TIMEOUT=0)
+@pytest.mark.django_db
+class KeysetPaginationAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        Post.objects.bulk_create([Post(title=f"title{i % 7}", body="body", author=self.user, safe=i % 3 > 0)
+                                  for i in range(100)])
+
+    def test_post_pages(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+
+        #Walking forward through the pages
+        pages = []
+        response = self.client.get(reverse('blog:post-list'), {'safe': True, 'ordering': '-title'})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        #Checking if the pages are the same as the database
+        posts = Post.objects.filter(safe=True).order_by('-title', 'pk')
+        titles = [post['title'] for page in pages for post in page['results']]
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(titles, [post.title for post in posts])
+        self.assertIsNone(pages[0]['previous'])
+
+        #Walking back to the first page
+        response = self.client.get(pages[1]['previous'])
+        self.assertEqual(response.data['results'], pages[0]['results'])
+        self.assertIsNone(response.data['previous'])
+
+        #Checking a bad cursor
+        response = self.client.get(reverse('blog:post-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+        #Checking tampered cursors are a 404 too, not a query that fails
+        for data in ({'p': 'ab', 'r': False}, {'p': [{}, 1], 'r': False}, {'p': [None, 1], 'r': False},
+                     {'p': ['title1', 1], 'r': 'yes'}, {'p': ['yesterday', 1], 'r': False}, [1, 2]):
+            cursor = base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+            response = self.client.get(reverse('blog:post-list'), {'ordering': 'created_at', 'cursor': cursor})
+            self.assertEqual(response.status_code, 404, data)
+
+    def test_timestamp_pages(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+        #Checking a seek on created_at keeps the microseconds: all the posts are in the same millisecond
+        start = timezone.now().replace(microsecond=0)
+        posts = list(Post.objects.order_by('pk'))
+        for i, post in enumerate(posts):
+            post.created_at = start + timedelta(microseconds=i)
+            post.title = f'post{i}'
+        Post.objects.bulk_update(posts, ['created_at', 'title'])
+        titles = []
+        response = self.client.get(reverse('blog:post-list'), {'ordering': 'created_at'})
+        #a cursor that repeats rows would never end
+        for page in range(5):
+            titles += [post['title'] for post in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(titles, [post.title for post in posts])
+
+@pytest.mark.django_db
+class PostFullTextSearchAPITest(APITestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username=name, password="testpassword")
+                      for name in ('Ringo', 'Paul')]
+        self.posts = [Post.objects.create(title="Ringo plays drums", body="drums drums", author=self.users[1]),
+                      Post.objects.create(title="Paul sings", body="and Ringo drums", author=self.users[1],
+                                          safe=False),
+                      Post.objects.create(title="Nothing here", body="empty", author=self.users[0]),
+                      Post.objects.create(title="Nothing either", body="empty", author=self.users[1])]
+
+    def search(self, **params):
+        response = self.client.get(reverse('blog:post-list'), {'search_mode': 'fulltext', **params})
+        self.assertEqual(response.status_code, 200)
+        return [post['title'] for post in response.data['results']]
+
+    def test_post_fulltext_search(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.users[0])
+
+        #Checking prefix matching over title, body and author
+        self.assertCountEqual(self.search(search='ring'),
+                              ["Ringo plays drums", "Paul sings", "Nothing here"])
+        self.assertEqual(self.search(search='ring drum'), ["Ringo plays drums", "Paul sings"])
+        self.assertEqual(self.search(search='ingo'), [])
+
+        #Checking it combines with the filters and the ordering
+        self.assertEqual(self.search(search='drums', safe=False), ["Paul sings"])
+        self.assertEqual(self.search(search='drums', ordering='title'), ["Paul sings", "Ringo plays drums"])
+
+        #Checking the index follows updates and deletes
+        self.posts[2].title = "Ringo is back"
+        self.posts[2].save()
+        self.posts[0].delete()
+        self.assertCountEqual(self.search(search='back'), ["Ringo is back"])
+        self.assertEqual(self.search(search='plays'), [])
+
+        #Checking the index follows a renamed author
+        self.users[0].username = 'Starr'
+        self.users[0].save()
+        self.assertEqual(self.search(search='starr'), ["Ringo is back"])
+        self.assertCountEqual(self.search(search='ringo'), ["Paul sings", "Ringo is back"])
+
+def sequential_scans(connection, sql):
+    #Full scans of the blog tables in the plan of sql. A SQLite table is its own rowid index,
+    #so an id-ordered scan with a LIMIT is an index scan that stops early.
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql.replace('%', '%%'))
+            return [row[0].strip() for row in cursor.fetchall() if 'Seq Scan on blog_' in row[0]]
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql.replace('%', '%%'))
+        scans = []
+        for row in cursor.fetchall():
+            words = row[3].split()
+            if words[0] != 'SCAN' or not words[1].startswith('blog_') or 'USING' in words:
+                continue
+            if f'ORDER BY "{words[1]}"."id" ASC LIMIT' not in sql:
+                scans.append(row[3])
+        return scans
+
+@override_settings(BLOG_RESPONSE_CACHE_TIMEOUT=0)
+@pytest.mark.django_db
+class QueryPlanTest(APITestCase):
+    rows = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'user{i}', password='!') for i in range(200)])
+        cls.posts = Post.objects.bulk_create([Post(title=f'title{i % 97}', body='body', author=cls.users[i % 200],
+                                                   safe=i % 3 > 0) for i in range(cls.rows)])
+        cls.comments = Comment.objects.bulk_create([Comment(body='body', author=cls.users[i % 200],
+                                                            post=cls.posts[i]) for i in range(cls.rows)])
+        UserTag.objects.bulk_create([UserTag(user=cls.users[i % 200], post=cls.posts[i * 7 % cls.rows])
+                                     for i in range(cls.rows)])
+        Like.objects.bulk_create([Like(user=cls.users[i % 200], content_object=cls.posts[i]) for i in range(cls.rows)])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertNoSequentialScans(self, method, url, data=None, follow_next=True):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+            self.assertLess(response.status_code, 300)
+            if follow_next and method == 'get' and response.data.get('next'):
+                self.client.get(response.data['next'])
+        for query in queries.captured_queries:
+            if query['sql'].split()[0] in ('SELECT', 'UPDATE', 'DELETE'):
+                self.assertEqual(sequential_scans(connection, query['sql']), [], f"{url}: {query['sql']}")
+
+    def test_no_sequential_scans(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.users[0])
+        post, comment = self.posts[10], self.comments[10]
+
+        for params in ['', '?safe=true', '?safe=false', '?ordering=title', '?ordering=-title',
+                       '?ordering=-safe', '?ordering=created_at']:
+            self.assertNoSequentialScans('get', reverse('blog:post-list') + params)
+        self.assertNoSequentialScans('get', reverse('blog:post-detail', args=[post.pk]))
+        self.assertNoSequentialScans('get', reverse('blog:comment-list'))
+        self.assertNoSequentialScans('get', reverse('blog:comment-detail', args=[comment.pk]))
+        self.assertNoSequentialScans('get', reverse('blog:post-comments-list', args=[post.pk]))
+        self.assertNoSequentialScans('get', reverse('blog:post-tagged-users', args=[post.pk]))
+        self.assertNoSequentialScans('get', reverse('blog:post-tagged-posts', args=[self.users[3].pk]))
+        self.assertNoSequentialScans('post', reverse('blog:post-like', args=[post.pk]))
+        self.assertNoSequentialScans('post', reverse('blog:comment-like', args=[comment.pk]))
+        self.assertNoSequentialScans('post', reverse('blog:like-batch'), {'likes': [
+            {'content_type': 'post', 'object_id': post.pk, 'liked': True},
+            {'content_type': 'comment', 'object_id': comment.pk, 'liked': False},
+        ]})
+
+@override_settings(BLOG_RESPONSE_CACHE_TIMEOUT=300)
+@pytest.mark.django_db
+class ResponseCacheAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', is_staff=True)
+        self.post = Post.objects.create(title='test', body='test', author=self.user)
+        self.comment = Comment.objects.create(body='test', author=self.user, post=self.post)
+
+    def test_post_cache(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+        url = reverse('blog:post-detail', kwargs={'pk': self.post.pk})
+
+        #Checking the second read is served from the cache, only the ETag rows hit the database
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        #Checking writes invalidate the cached responses
+        Comment.objects.create(body='test2', author=self.user, post=self.post)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['comments_count'], 2)
+
+        self.client.post(reverse('blog:post-like', args=[self.post.pk]))
+        response = self.client.get(url)
+        self.assertEqual(response.data['likes_count'], 1)
+
+        #Checking the comments show the new post title
+        response = self.client.get(reverse('blog:comment-list'))
+        self.post.title = 'changed'
+        self.post.save()
+        response = self.client.get(reverse('blog:comment-list'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['post']['title'], 'changed')
+
+        #Checking the single post shows its author's new username
+        self.client.get(url)
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['author'], 'renamed')
+
+        #Checking the hit and miss counters are exposed
+        response = self.client.get(reverse('blog:cache-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.data['hits'], 0)
+        self.assertGreater(response.data['misses'], 0)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'other.example'])
+    def test_host_keys(self):
+        #Checking each host gets its own entry, the next page link is built on it
+        self.client.force_authenticate(user=self.user)
+        url = reverse('blog:post-list')
+        Post.objects.create(title='test2', body='test', author=self.user)
+        with mock.patch.object(KeysetPagination, 'page_size', 1):
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+            response = self.client.get(url, HTTP_HOST='other.example')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.data['next'].startswith('http://other.example/'))
+
+    def test_read_your_writes(self):
+        self.client.force_authenticate(user=self.user)
+        reader = APIClient()
+        reader.force_authenticate(user=self.user)
+        url = reverse('blog:post-detail', kwargs={'pk': self.post.pk})
+        etag = self.client.get(url)['ETag']
+
+        #The write bumps the versions and the writer gets the sticky cookie, another client's read
+        #of a lagging replica (the old title, put back without signals) fills the new entry
+        self.client.patch(url, {'title': 'changed'})
+        self.assertIn(settings.BLOG_REPLICA_COOKIE, self.client.cookies)
+        Post.objects.filter(pk=self.post.pk).update(title='test')
+        self.assertEqual(reader.get(url).data['title'], 'test')
+        Post.objects.filter(pk=self.post.pk).update(title='changed')
+
+        #Checking the writer skips that entry and reads the primary, and gets no 304 either
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['title'], 'changed')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reader.get(url).data['title'], 'changed')
+        self.assertEqual(reader.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        #Checking a miss builds the response from the primary
+        allowed = []
+        handler = ListModelMixin.list
+
+        def list(view, *args, **kwargs):
+            allowed.append(routers.replica_reads.get())
+            return handler(view, *args, **kwargs)
+        with mock.patch.object(ListModelMixin, 'list', list):
+            response = reader.get(reverse('blog:post-list'))
+        self.assertEqual((response['X-Cache'], allowed), ('MISS', [False]))
+
+    def test_shared_cache_check(self):
+        #Checking a per-process cache is refused, the other workers would never see the writes
+        self.assertEqual([error.id for error in check_response_cache(None)], ['blog.E001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                                   'LOCATION': 'redis://localhost:6379'}}):
+            self.assertEqual(check_response_cache(None), [])
+        with override_settings(BLOG_RESPONSE_CACHE_TIMEOUT=0):
+            self.assertEqual(check_response_cache(None), [])
+
+
+@pytest.mark.django_db
+class ConditionalGetAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.post = Post.objects.create(title='test', body='test', author=self.user)
+        self.comment = Comment.objects.create(body='test', author=self.user, post=self.post)
+        self.client.force_authenticate(user=self.user)
+
+    def test_post_etag(self):
+        url = reverse('blog:post-detail', kwargs={'pk': self.post.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        #Checking a matching ETag gets a 304 from one query
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        #Checking likes, comments and edits change the ETag
+        for write in (lambda: self.client.post(reverse('blog:post-like', args=[self.post.pk])),
+                      lambda: Comment.objects.create(body='test2', author=self.user, post=self.post),
+                      lambda: self.client.patch(url, {'title': 'changed'})):
+            write()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+        self.assertEqual(response.data['title'], 'changed')
+        self.assertEqual(response.data['likes_count'], 1)
+
+        #Checking a missing post is still a 404
+        response = self.client.get(reverse('blog:post-detail', kwargs={'pk': 0}), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+        #Checking the author's new username changes the ETag
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['author'], 'renamed')
+
+    def test_list_etag(self):
+        url = reverse('blog:post-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        #Checking filters get their own ETag
+        response = self.client.get(url, {'search': 'test'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        #Checking deletes change the ETag
+        Post.objects.create(title='test2', body='test2', author=self.user).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        #Checking a list has no Last-Modified and ignores If-Modified-Since, a delete moves no timestamp
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        self.post.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+
+    def test_comment_etag(self):
+        url = reverse('blog:comment-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        #Checking the comments notice the post's new title
+        self.post.title = 'changed'
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['post']['title'], 'changed')
+
+        #Checking the comments notice their author's new username
+        etag = response['ETag']
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['author'], 'renamed')
+
+@pytest.mark.django_db
+class TableCountTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        for i in range(3):
+            Post.objects.create(title=f'test{i}', body='test', author=self.user, safe=i > 0)
+
+    def test_index_count(self):
+        #Checking the first read counts, the next ones read the counter row
+        response = self.client.get(reverse('blog:index'))
+        self.assertEqual(response.context['posts'], 3)
+        rows = TableCount.objects.filter(table=Post._meta.db_table)
+        self.assertEqual(rows.count(), settings.BLOG_COUNT_SLOTS)
+        self.assertEqual(sum(row.count for row in rows), 3)
+
+        #Checking the signals keep it in sync
+        post = Post.objects.create(title='test3', body='test', author=self.user)
+        Comment.objects.create(body='test', author=self.user, post=post)
+        self.assertEqual(counts.count(Post), 4)
+        self.assertEqual(counts.count(Comment), 1)
+        post.delete()
+        self.assertEqual(counts.count(Post), 3)
+        self.assertEqual(counts.count(Comment), 0)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('blog:index'))
+        self.assertEqual(response.context['posts'], 3)
+
+        #Checking the bumps are spread over the slots and a missing slot is a recount
+        for i in range(20):
+            Post.objects.create(title=f'spread{i}', body='test', author=self.user)
+        self.assertGreater(TableCount.objects.filter(table=Post._meta.db_table).exclude(slot=0)
+                           .exclude(count=0).count(), 0)
+        self.assertEqual(counts.count(Post), 23)
+        TableCount.objects.filter(table=Post._meta.db_table, slot=1).delete()
+        Post.objects.create(title='spread', body='test', author=self.user)
+        self.assertEqual(counts.count(Post), 24)
+        with override_settings(BLOG_COUNT_SLOTS=4):
+            self.assertEqual(counts.count(Post), 24)
+            self.assertEqual(TableCount.objects.filter(table=Post._meta.db_table).count(), 4)
+
+    def test_stale_count(self):
+        counts.count(Post)
+        #bulk_create skips the signals
+        Post.objects.bulk_create([Post(title='bulk', body='bulk', author=self.user)])
+        self.assertEqual(counts.count(Post), 3)
+        self.assertEqual(counts.count(Post, approximate=True), 3)
+        #Checking a stale count another reader is recounting is answered as it is, without a COUNT
+        rows = TableCount.objects.filter(table=Post._meta.db_table)
+        rows.update(counted_at=timezone.now() - timedelta(seconds=settings.BLOG_COUNT_MAX_AGE + 60))
+        rows.filter(slot=0).update(counted_at=timezone.now())
+        with self.assertNumQueries(2):
+            self.assertEqual(counts.count(Post), 3)
+        with override_settings(BLOG_COUNT_MAX_AGE=0):
+            self.assertEqual(counts.count(Post), 4)
+        self.assertEqual(counts.queryset_count(Post.objects.filter(safe=True)), 3)
+
+    @override_settings(BLOG_RESPONSE_CACHE_TIMEOUT=0)
+    def test_list_count(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+
+        #Checking the total is only there when asked for
+        response = self.client.get(reverse('blog:post-list'))
+        self.assertNotIn('count', response.data)
+        response = self.client.get(reverse('blog:post-list'), {'count': 'true'})
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get(reverse('blog:post-list'), {'count': 'true', 'safe': 'false'})
+        self.assertEqual(response.data['count'], 1)
+
+        #Checking a new post on a later page changes the ETag of a counted first page
+        with mock.patch.object(KeysetPagination, 'page_size', 2):
+            params = {'count': 'true', 'ordering': 'title'}
+            etag = self.client.get(reverse('blog:post-list'), params)['ETag']
+            Post.objects.create(title='z', body='test', author=self.user)
+            response = self.client.get(reverse('blog:post-list'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(len(response.data['results']), 2)
+
+def image_upload(name, size=(2000, 1500)):
+    #A JPEG carrying an EXIF block
+    exif = Image.Exif()
+    exif[0x010f] = 'TestCamera'
+    output = BytesIO()
+    Image.new('RGB', size, 'red').save(output, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+@override_settings(BLOG_RESPONSE_CACHE_TIMEOUT=0)
+@pytest.mark.django_db
+class ImageVariantTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_variants(self):
+        #Checking nothing is resized before the task runs
+        post = Post.objects.create(title='test', body='test', author=self.user, img=image_upload('photo.jpg'))
+        self.assertEqual(post.img_variants, {})
+        self.assertEqual(tasks.run_pending(), 1)
+        post.refresh_from_db()
+        self.assertEqual(post.img_variants['source'], post.img.name)
+
+        #Checking the variants are bounded, re-encoded and without EXIF
+        for variant, box in images.VARIANTS.items():
+            with Image.open(post.img.storage.path(post.img_variants[variant])) as image:
+                self.assertEqual(image.format, 'WEBP')
+                self.assertTrue(image.width <= box[0] and image.height <= box[1])
+                self.assertEqual(len(image.getexif()), 0)
+
+        #Checking the api shows the variants
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('blog:post-detail', args=[post.pk]))
+        self.assertTrue(response.data['img_variants']['thumb'].endswith(post.img_variants['thumb']))
+
+        #Checking swapping the image shows the placeholder and removes the old variants
+        old = [post.img.storage.path(post.img_variants[variant]) for variant in images.VARIANTS]
+        post.img = image_upload('photo2.jpg')
+        post.save()
+        response = self.client.get(reverse('blog:post-detail', args=[post.pk]))
+        self.assertTrue(response.data['img_variants']['thumb'].endswith('placeholder.svg'))
+        self.assertEqual(tasks.run_pending(), 2)
+        self.assertFalse(any(os.path.exists(path) for path in old))
+        response = self.client.get(reverse('blog:post-detail', args=[post.pk]))
+        self.assertIn('photo2_thumb', response.data['img_variants']['thumb'])
+
+        #Checking deleting the post removes them
+        post.refresh_from_db()
+        paths = [post.img.storage.path(post.img_variants[variant]) for variant in images.VARIANTS]
+        post.delete()
+        tasks.run_pending()
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_unreadable_image(self):
+        img_file = SimpleUploadedFile('broken.jpg', b'file_content', content_type='image/jpeg')
+        post = Post.objects.create(title='test', body='test', author=self.user, img=img_file)
+        tasks.run_pending()
+
+        #Checking the original is served instead
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('blog:post-detail', args=[post.pk]))
+        self.assertEqual(response.data['img_variants']['medium'], response.data['img'])
+
+@override_settings(BLOG_TASK_MAX_ATTEMPTS=3, BLOG_TASK_RETRY_DELAY=10)
+@pytest.mark.django_db
+class TaskQueueTest(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        tasks.REGISTRY['test.flaky'] = self.flaky
+
+    def tearDown(self):
+        del tasks.REGISTRY['test.flaky']
+
+    def flaky(self, fail_times):
+        self.calls.append(fail_times)
+        if len(self.calls) <= fail_times:
+            raise OSError('storage is down')
+
+    def test_retry(self):
+        #Checking a failing task comes back after the backoff
+        task = tasks.enqueue('test.flaky', 1)
+        self.assertEqual(tasks.run_pending(), 0)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.PENDING, 1))
+        self.assertIn('storage is down', task.last_error)
+        self.assertEqual(tasks.run_pending(), 0)
+        with mock.patch('django.utils.timezone.now', return_value=task.run_at):
+            self.assertEqual(tasks.run_pending(), 1)
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(tasks.backoff(1), 10)
+        self.assertEqual(tasks.backoff(3), 40)
+
+    def test_failure(self):
+        #Checking it gives up after the max attempts
+        task = tasks.enqueue('test.flaky', 5)
+        for i in range(3):
+            Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+            tasks.run_pending()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 3))
+        self.assertEqual(tasks.run_pending(), 0)
+
+    def test_lease(self):
+        #Checking a task claimed by a worker that died is claimed again
+        tasks.enqueue('test.flaky', 0)
+        self.assertEqual(len(tasks.claim(10)), 1)
+        self.assertEqual(tasks.claim(10), [])
+        Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(tasks.run_pending(), 1)
+
+        #Checking a worker whose lease ran out leaves alone the task another worker claimed since
+        self.calls = []
+        task = tasks.enqueue('test.flaky', 1)
+        [stale] = tasks.claim(10)
+        Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        [claimed] = tasks.claim(10)
+        self.assertFalse(tasks.run(stale))
+        self.assertTrue(tasks.run(stale))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.locked_until, task.attempts), (Task.RUNNING, claimed.locked_until, 2))
+
+    def test_rollback(self):
+        #Checking a rolled back write takes its task with it
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                tasks.enqueue('test.flaky', 0)
+                raise ValueError
+        self.assertFalse(Task.objects.exists())
+        with self.assertRaises(LookupError):
+            tasks.enqueue('test.missing')
+
+    def test_command(self):
+        tasks.enqueue('test.flaky', 0)
+        out = StringIO()
+        call_command('run_tasks', '--once', '--workers', '1', stdout=out)
+        self.assertIn('1 tasks done', out.getvalue())
+        self.assertEqual(self.calls, [0])
+
+
+@pytest.mark.django_db
+class ChangeTrackingTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.post = Post.objects.create(title='test', body='test', author=self.user)
+
+    def test_save_changed_fields(self):
+        post = Post.objects.get(pk=self.post.pk)
+
+        #Checking an unchanged post isn't written at all
+        with self.assertNumQueries(0):
+            post.save()
+
+        #Checking only the changed field and updated_at are written, without reading the row first,
+        #the other UPDATE copies the new title to the tagged-posts feed
+        post.title = 'changed'
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        statements = [query['sql'] for query in queries.captured_queries
+                      if query['sql'].startswith(('SELECT', 'UPDATE "blog_post"'))]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('"title"', statements[0])
+        self.assertIn('"updated_at"', statements[0])
+        self.assertNotIn('"body"', statements[0])
+        self.assertEqual(post.changed_fields(), [])
+
+        #Checking the handlers get the changed fields
+        received = []
+        handler = lambda sender, update_fields, **kwargs: received.append(update_fields)
+        post_save.connect(handler, sender=Post)
+        try:
+            post.body = 'changed'
+            post.save()
+        finally:
+            post_save.disconnect(handler, sender=Post)
+        self.assertEqual(received, [frozenset({'body', 'updated_at'})])
+
+        #Checking a stale copy doesn't undo other writes
+        stale = Post.objects.get(pk=self.post.pk)
+        post.title = 'newer'
+        post.save()
+        stale.body = 'stale'
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual((stale.title, stale.body), ('newer', 'stale'))
+        self.assertEqual(stale.changed_fields(), [])
+
+        #Checking a change to a deleted post isn't lost silently
+        Post.objects.filter(pk=post.pk).delete()
+        post.title = 'deleted'
+        with self.assertRaises(DatabaseError):
+            with transaction.atomic():
+                post.save()
+
+    def test_patch_queries(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(reverse('blog:post-detail', args=[self.post.pk]), {'title': 'changed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if query['sql'].startswith('UPDATE "blog_post"')]), 1)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).title, 'changed')
+
+@pytest.mark.django_db(transaction=True)
+class DeletedRowAPITest(APITransactionTestCase):
+
+    def test_patch_deleted(self):
+        #Checking a post deleted while the PATCH was saving it is a 404
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        post = Post.objects.create(title='test', body='test', author=user)
+        self.client.force_authenticate(user=user)
+        save = Post.save
+        def delete_first(instance, *args, **kwargs):
+            Post.objects.filter(pk=instance.pk).delete()
+            return save(instance, *args, **kwargs)
+        with mock.patch.object(Post, 'save', delete_first):
+            response = self.client.patch(reverse('blog:post-detail', args=[post.pk]), {'title': 'changed'})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Post.objects.exists())
+
+@pytest.mark.django_db
+class AsyncReadAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other = User.objects.create_user(username='other', password='testpassword')
+        self.posts = [Post.objects.create(title=f'test{i}', body='test', author=self.user, safe=i % 2 == 0)
+                      for i in range(5)]
+        for post in self.posts:
+            Comment.objects.create(body=f'comment {post.title}', author=self.other, post=post)
+            UserTag.objects.create(user=self.other, post=post)
+
+    @override_settings(BLOG_RESPONSE_CACHE_TIMEOUT=0)
+    def test_async_reads_match(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+        pairs = [
+            (reverse('blog:post-list') + '?safe=true&ordering=-title', reverse('blog:async-post-list') + '?safe=true&ordering=-title'),
+            (reverse('blog:post-detail', args=[self.posts[1].pk]), reverse('blog:async-post-detail', args=[self.posts[1].pk])),
+            (reverse('blog:comment-list'), reverse('blog:async-comment-list')),
+            (reverse('blog:post-tagged-users', args=[self.posts[0].pk]), reverse('blog:async-post-tagged-users', args=[self.posts[0].pk])),
+            (reverse('blog:post-tagged-posts', args=[self.other.pk]), reverse('blog:async-post-tagged-posts', args=[self.other.pk])),
+            (reverse('blog:post-tagged-posts', args=[self.other.pk]) + '?safe=true&ordering=-title',
+             reverse('blog:async-post-tagged-posts', args=[self.other.pk]) + '?safe=true&ordering=-title'),
+        ]
+        #Checking the async views answer like the uncached viewsets, in no more queries
+        for sync_url, async_url in pairs:
+            with CaptureQueriesContext(connection) as sync_queries:
+                expected = self.client.get(sync_url, HTTP_ACCEPT='application/json')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(async_url)
+            self.assertLessEqual(len(queries), len(sync_queries))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(response.json().get('results', response.json()),
+                             expected.json().get('results', expected.json()))
+
+        #Checking the pagination links point back to the async views
+        with mock.patch.object(KeysetPagination, 'page_size', 3):
+            response = self.client.get(reverse('blog:async-post-list') + '?count=true')
+            self.assertEqual(response.json()['count'], 5)
+            response = self.client.get(response.json()['next'])
+        self.assertEqual([post['title'] for post in response.json()['results']], ['test3', 'test4'])
+
+    def test_async_errors(self):
+        #Checking unauthenticated requests are refused
+        response = self.client.get(reverse('blog:async-post-list'))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(reverse('blog:async-comment-list'), HTTP_AUTHORIZATION='Bearer nonsense')
+        self.assertEqual(response.status_code, 401)
+
+        #Checking a missing post is a 404
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('blog:async-post-detail', args=[self.posts[-1].pk + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_async_index(self):
+        #Checking the index counts the posts and greets the user
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('blog:async-index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'There is 5 posts to see')
+        self.assertContains(response, 'Welcome testuser')
+
+@pytest.mark.django_db
+@override_settings(BLOG_RESPONSE_CACHE_TIMEOUT=0)
+class QueryBudgetTest(APITestCase):
+    #Every budgeted read, at data sizes up to past a full page, within its viewset's query_budget
+    sizes = (1, 10, 100)
+    viewsets = (PostViewSet, CommentViewSet, PostCommentViewSet)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+
+    def grow(self, size):
+        #size posts by as many authors, each with a comment, a like and the user tagged, and all the
+        #authors commenting on and tagged in the first post
+        start = Post.objects.count()
+        users = User.objects.bulk_create([User(username=f'user{i}', password='!') for i in range(start, size)])
+        posts = Post.objects.bulk_create([Post(title=f'post{i}', body='body', author=user)
+                                          for i, user in enumerate(users, start)])
+        first = Post.objects.order_by('pk').first()
+        comments = Comment.objects.bulk_create([Comment(body='body', author=user, post=post)
+                                                for user, post in zip(users, posts)]
+                                               + [Comment(body='body', author=user, post=first) for user in users])
+        Like.objects.bulk_create([Like(user=self.user, content_object=obj) for obj in posts + comments])
+        UserTag.objects.tag_batch(first.pk, [user.pk for user in users])
+        for post in posts:
+            UserTag.objects.tag_batch(post.pk, [self.user.pk])
+        return first
+
+    def urls(self, post):
+        return {
+            (PostViewSet, 'list'): reverse('blog:post-list'),
+            (PostViewSet, 'retrieve'): reverse('blog:post-detail', args=[post.pk]),
+            (PostViewSet, 'get_tagged_users'): reverse('blog:post-tagged-users', args=[post.pk]),
+            (PostViewSet, 'get_tagged_posts'): reverse('blog:post-tagged-posts', args=[self.user.pk]),
+            (CommentViewSet, 'list'): reverse('blog:comment-list'),
+            (CommentViewSet, 'retrieve'): reverse('blog:comment-detail', args=[Comment.objects.first().pk]),
+            (PostCommentViewSet, 'list'): reverse('blog:post-comments-list', args=[post.pk]),
+        }
+
+    def test_query_budgets(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+        for size in self.sizes:
+            urls = self.urls(self.grow(size))
+            self.assertEqual(set(urls), {(viewset, action) for viewset in self.viewsets
+                                         for action in viewset.query_budget})
+            for (viewset, action), url in urls.items():
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(queries), viewset.query_budget[action],
+                                     f'{viewset.__name__}.{action} with {size} posts: '
+                                     + '\n'.join(query['sql'] for query in queries.captured_queries))
+                if size > KeysetPagination.page_size and 'results' in response.data:
+                    #a full page, a query per row would show
+                    self.assertEqual(len(response.data['results']), KeysetPagination.page_size)
+
+    @override_settings(BLOG_QUERY_COUNT_HEADERS=True)
+    def test_query_count_headers(self):
+        self.grow(3)
+        self.client.force_authenticate(user=self.user)
+        #Checking the headers count every query of the request, authentication included
+        for url in (reverse('blog:comment-list'), reverse('blog:async-comment-list')):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response['X-DB-Queries'], str(len(queries)))
+            self.assertGreaterEqual(float(response['X-DB-Time-ms']), 0)
+
+        #Checking they are off unless enabled
+        with override_settings(BLOG_QUERY_COUNT_HEADERS=False):
+            response = self.client.get(reverse('blog:comment-list'))
+        self.assertNotIn('X-DB-Queries', response)
+
+@pytest.mark.django_db
+@override_settings(BLOG_RESPONSE_CACHE_TIMEOUT=0, BLOG_QUERY_COUNT_HEADERS=True, BLOG_SERVER_TIMING=True)
+class ServerTimingTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.staff = User.objects.create_user(username='staff', password='testpassword', is_staff=True)
+        for i in range(3):
+            Post.objects.create(title=f'test{i}', body='test', author=self.user)
+
+    def timings(self, response):
+        return {entry.split(';')[0]: entry for entry in response['Server-Timing'].split(', ')}
+
+    def test_server_timing(self):
+        #Force authentication
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('blog:post-list'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        #Checking every phase is there and the db one counts the queries of the request
+        timings = self.timings(response)
+        self.assertEqual(list(timings), ['auth', 'serialize', 'render', 'db', 'app', 'total'])
+        self.assertIn(f'desc="{response["X-DB-Queries"]} queries"', timings['db'])
+        durations = {name: float(entry.split('dur=')[1].split(';')[0]) for name, entry in timings.items()}
+        self.assertAlmostEqual(sum(duration for name, duration in durations.items() if name != 'total'),
+                               durations['total'], delta=0.5)
+
+        #Checking the async views and plain Django views get it too
+        self.assertIn('serialize', self.timings(self.client.get(reverse('blog:async-post-list'))))
+        self.assertIn('total', self.timings(self.client.get(reverse('blog:index'))))
+        with override_settings(BLOG_SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('blog:post-list')))
+
+        #Checking 'staff' keeps the timings from everybody else
+        with override_settings(BLOG_SERVER_TIMING='staff'):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('blog:post-list')))
+            self.assertNotIn('Server-Timing', self.client.get(reverse('blog:async-post-list')))
+            self.client.force_authenticate(user=self.staff)
+            self.assertIn('Server-Timing', self.client.get(reverse('blog:post-list')))
+            self.assertIn('Server-Timing', self.client.get(reverse('blog:async-post-list')))
+
+    def test_requested_profile(self):
+        #Checking only staff get a profile when asking for one
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('blog:post-list'), HTTP_X_BLOG_PROFILE='1')
+        self.assertNotIn('X-Blog-Profile', response)
+        self.assertFalse(RequestProfile.objects.exists())
+        self.assertEqual(self.client.get(reverse('blog:profile-list')).status_code, 403)
+
+        self.client.force_authenticate(user=self.staff)
+        response = self.client.get(reverse('blog:post-list') + '?profile=1')
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response['X-Blog-Profile'], reverse('blog:profile-download', args=[profile.pk]))
+        self.assertEqual((profile.trigger, profile.user, profile.status_code), ('requested', self.staff, 200))
+        self.assertEqual(profile.queries, int(response['X-DB-Queries']))
+        self.assertIn('serialize', profile.timings)
+
+        #Checking the list and the download, a file pstats reads
+        response = self.client.get(reverse('blog:profile-list'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['results'][0]['path'], reverse('blog:post-list') + '?profile=1')
+        response = self.client.get(reverse('blog:profile-download', args=[profile.pk]))
+        self.assertEqual(response.status_code, 200)
+        with tempfile.NamedTemporaryFile(suffix='.prof') as file:
+            file.write(response.content)
+            file.flush()
+            functions = [function for filename, line, function in pstats.Stats(file.name).stats]
+        self.assertIn('list', functions)
+
+    def test_sampled_profiles(self):
+        self.client.force_authenticate(user=self.user)
+        unprofiled = self.client.get(reverse('blog:post-list'))
+        #Checking every request is profiled at a rate of 1, only the newest kept, without adding
+        #to the request's queries or telling the client
+        with override_settings(BLOG_PROFILE_SAMPLE_RATE=1, BLOG_PROFILE_KEEP=2):
+            for i in range(3):
+                response = self.client.get(reverse('blog:post-list'))
+                self.assertEqual(response['X-DB-Queries'], unprofiled['X-DB-Queries'])
+                self.assertNotIn('X-Blog-Profile', response)
+            #Checking the requests only queue them, the task worker stores them
+            self.assertFalse(RequestProfile.objects.exists())
+            self.assertEqual(tasks.run_pending(), 3)
+        self.assertEqual(list(RequestProfile.objects.values_list('trigger', 'user', 'status_code')),
+                         [('sampled', self.user.pk, 200)] * 2)
+        self.assertFalse(profiling.profiling.locked())
+
+@override_settings(BLOG_READ_REPLICAS=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def route(self, request):
+        #The alias the view's reads would use
+        return ReplicaMiddleware(lambda request: HttpResponse(router.db_for_read(Post)))(request)
+
+    def test_router(self):
+        #Checking reads stay on the primary unless a request allowed the replicas
+        self.assertEqual(router.db_for_read(Post), 'default')
+        token = routers.replica_reads.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Post), 'replica')
+            self.assertEqual(router.db_for_write(Post), 'default')
+            #sessions and users are read back right after a login
+            self.assertEqual(router.db_for_read(User), 'default')
+            with override_settings(BLOG_READ_REPLICAS=[]):
+                self.assertEqual(router.db_for_read(Post), 'default')
+        finally:
+            routers.replica_reads.reset(token)
+        self.assertFalse(router.allow_migrate('replica', 'blog'))
+        self.assertTrue(router.allow_migrate('default', 'blog'))
+
+    def test_middleware(self):
+        #Checking reads go to the replica, writes and what follows them to the primary
+        response = self.route(self.factory.get('/blog/api/post/'))
+        self.assertEqual(response.content, b'replica')
+        self.assertNotIn(settings.BLOG_REPLICA_COOKIE, response.cookies)
+        response = self.route(self.factory.post('/blog/api/post/'))
+        self.assertEqual(response.content, b'default')
+        cookie = response.cookies[settings.BLOG_REPLICA_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.BLOG_REPLICA_STICKY_SECONDS)
+        request = self.factory.get('/blog/api/post/')
+        request.COOKIES[settings.BLOG_REPLICA_COOKIE] = cookie.value
+        self.assertEqual(self.route(request).content, b'default')
+        #the request's choice doesn't leak to whatever runs next
+        self.assertEqual(router.db_for_read(Post), 'default')
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            return HttpResponse(router.db_for_read(Post))
+        middleware = ReplicaMiddleware(get_response)
+        response = async_to_sync(middleware)(self.factory.get('/blog/async'))
+        self.assertEqual(response.content, b'replica')
+        response = async_to_sync(middleware)(self.factory.delete('/blog/api/post/1/'))
+        self.assertEqual(response.content, b'default')
+        self.assertIn(settings.BLOG_REPLICA_COOKIE, response.cookies)
+
+@pytest.mark.django_db
+class ExportAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', is_staff=True)
+        self.other = User.objects.create_user(username='other', password='testpassword')
+        self.post = Post.objects.create(title='test', body='test, with a comma', author=self.user)
+        self.comment = Comment.objects.create(body='test', author=self.other, post=self.post)
+        UserTag.objects.create(user=self.other, post=self.post)
+        Like.objects.create(user=self.other, content_object=self.post)
+
+    def export(self, **params):
+        response = self.client.get(reverse('blog:export'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        #Checking it's for admins only
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.client.get(reverse('blog:export')).status_code, 403)
+        self.client.force_authenticate(user=self.user)
+
+        records = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([record['type'] for record in records], ['post', 'comment', 'like', 'usertag'])
+        self.assertEqual(records[0]['author'], 'testuser')
+        self.assertEqual(records[0]['like_count'], 1)
+        self.assertEqual((records[2]['content_type'], records[2]['object_id']), ('post', self.post.pk))
+
+        #Checking the watermark overlaps the export, rows committed late aren't missed
+        watermark = self.client.get(reverse('blog:export'))['X-Export-Watermark']
+        self.assertLess(parse(watermark), timezone.now() - timedelta(seconds=settings.BLOG_EXPORT_OVERLAP - 1))
+        self.assertEqual(len(self.export(since=watermark).splitlines()), 4)
+
+        #Checking the since watermark only exports the later writes
+        with override_settings(BLOG_EXPORT_OVERLAP=0):
+            watermark = self.client.get(reverse('blog:export'))['X-Export-Watermark']
+        self.assertEqual(self.export(since=watermark), '')
+        self.comment.body = 'edited'
+        self.comment.save()
+        records = [json.loads(line) for line in self.export(since=watermark).splitlines()]
+        self.assertEqual([(record['type'], record['body']) for record in records], [('comment', 'edited')])
+
+        #Checking bad parameters
+        for params in ({'output': 'xml'}, {'models': 'post,user'}, {'since': 'yesterday'}):
+            self.assertEqual(self.client.get(reverse('blog:export'), params).status_code, 400)
+
+    def test_export_csv(self):
+        self.client.force_authenticate(user=self.user)
+        rows = list(csv.DictReader(StringIO(self.export(output='csv', models='post,comment'))))
+        self.assertEqual([row['type'] for row in rows], ['post', 'comment'])
+        self.assertEqual(rows[0]['body'], 'test, with a comma')
+        self.assertEqual(rows[1]['post_id'], str(self.post.pk))
+        self.assertEqual(rows[1]['title'], '')
+
+    def test_export_command(self):
+        out, err = StringIO(), StringIO()
+        call_command('export_blog', '--models', 'usertag', stdout=out, stderr=err)
+        self.assertEqual(json.loads(out.getvalue())['user'], 'other')
+        self.assertIn('Next --since', err.getvalue())
+
+@pytest.mark.django_db
+class ImportTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other = User.objects.create_user(username='other', password='testpassword')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            file.writelines(lines)
+        return path
+
+    def test_round_trip(self):
+        post = Post.objects.create(title='test', body='tab\tand\nnewline', author=self.user)
+        comment = Comment.objects.create(body='test', author=None, post=post)
+        UserTag.objects.create(user=self.other, post=post)
+        Like.objects.create(user=self.other, content_object=comment)
+        created_at = post.created_at
+
+        for output in export.OUTPUTS:
+            path = self.write(f'blog.{output}', export.lines(output, list(export.EXPORTS)))
+            Post.objects.all().delete()
+            self.assertFalse(Like.objects.exists())
+            out = StringIO()
+            call_command('import_blog', path, stdout=out)
+            self.assertIn('4 rows loaded', out.getvalue())
+
+            #Checking the ids, dates and relations come back, and the counters are rebuilt
+            imported = Post.objects.get(pk=post.pk)
+            self.assertEqual((imported.body, imported.author, imported.created_at),
+                             ('tab\tand\nnewline', self.user, created_at))
+            self.assertEqual((imported.comment_count, imported.tag_count), (1, 1))
+            self.assertEqual(Comment.objects.get(pk=comment.pk).like_count, 1)
+            self.assertIsNone(Comment.objects.get(pk=comment.pk).author)
+            self.assertEqual(counts.count(Post), 1)
+            self.assertEqual(list(TaggedPost.objects.values_list('user', 'post', 'post_title')),
+                             [(self.other.pk, post.pk, 'test')])
+
+        #Checking new rows get ids after the imported ones
+        self.assertGreater(Post.objects.create(title='new', body='new', author=self.user).pk, post.pk)
+
+    def test_unknown_users(self):
+        path = self.write('posts.jsonl', [json.dumps({'type': 'post', 'id': 500, 'title': 'old', 'body': 'old',
+                                                      'author': 'newcomer', 'safe': True,
+                                                      'created_at': '2020-01-01T00:00:00Z'}) + '\n'])
+        with self.assertRaises(CommandError):
+            call_command('import_blog', path, stdout=StringIO())
+        self.assertFalse(Post.objects.exists())
+
+        call_command('import_blog', path, '--create-users', stdout=StringIO())
+        post = Post.objects.get(pk=500)
+        self.assertEqual(post.author.username, 'newcomer')
+        self.assertFalse(post.author.has_usable_password())
+        self.assertEqual(post.created_at.year, 2020)
+
+@pytest.mark.django_db
+class SeedTestCase(TestCase):
+
+    def seed(self, *args):
+        out = StringIO()
+        call_command('seed_blog', '--users', '20', '--posts', '50', '--comments', '200', '--likes', '300',
+                     '--tags', '100', *args, stdout=out)
+        return out.getvalue()
+
+    def test_seed(self):
+        out = self.seed()
+        self.assertIn('rows loaded', out)
+        self.assertEqual((User.objects.count(), Post.objects.count(), Comment.objects.count()), (20, 50, 200))
+        self.assertEqual(Like.objects.count(), 300)
+        self.assertEqual(UserTag.objects.count(), 100)
+
+        #Checking the counters and the feed are rebuilt
+        post = Post.objects.order_by('-comment_count').first()
+        self.assertEqual(post.comment_count, Comment.objects.filter(post=post).count())
+        self.assertEqual(post.tag_count, UserTag.objects.filter(post=post).count())
+        self.assertEqual(TaggedPost.objects.count(), 100)
+
+        #Checking the skew: the busiest author writes well over an even share
+        busiest = Post.objects.values('author').annotate(total=Count('pk')).order_by('-total')[0]
+        self.assertGreater(busiest['total'], 50 / 20 * 3)
+
+    def test_bad_counts(self):
+        #Checking counts it can't make are refused before anything is written
+        for args in (['--users', '0'], ['--posts', '0'], ['--likes', '-1']):
+            with self.assertRaises(CommandError):
+                self.seed(*args)
+        self.assertFalse(User.objects.exists())
+
+        #Checking a failed load takes its users with it
+        with mock.patch.object(importer.Loader, 'reset_sequences', side_effect=ValueError('failed')):
+            with self.assertRaises(CommandError):
+                self.seed()
+        self.assertFalse(User.objects.exists())
+
+    def test_same_seed(self):
+        self.seed()
+        first = list(Post.objects.order_by('pk').values_list('title', 'author__username'))
+        #Checking a second run adds new rows after the first ones, the same data with the same seed
+        self.seed('--seed', '42')
+        self.assertEqual(Post.objects.count(), 100)
+        second = list(Post.objects.order_by('pk').values_list('title', 'author__username')[50:])
+        self.assertEqual([title for title, author in first], [title for title, author in second])
+        self.assertNotEqual(first[0][1], second[0][1])
+
+@pytest.mark.django_db(transaction=True)
+class ImportIndexTestCase(TransactionTestCase):
+
+    def test_rebuilt_indexes(self):
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        path = os.path.join(tempfile.mkdtemp(), 'posts.jsonl')
+        with open(path, 'w') as file:
+            file.writelines(json.dumps({'type': 'post', 'id': i, 'title': f'title{i}', 'body': 'body',
+                                        'author': user.username, 'img': f'old/{i}.jpg'}) + '\n'
+                            for i in range(1, 101))
+        call_command('import_blog', path, '--batch-size', '30', '--drop-indexes', stdout=StringIO())
+
+        #Checking the indexes are back and the images are queued for resizing
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Post._meta.db_table)
+        self.assertIn('blog_post_title_idx', constraints)
+        self.assertEqual(Post.objects.count(), 100)
+        self.assertEqual(Task.objects.filter(name='blog.process_image').count(), 100)
+
+        #Checking a failed load is a CommandError that leaves the indexes and counts as they were
+        with open(path, 'a') as file:
+            file.write(json.dumps({'type': 'post', 'id': 101, 'title': 'new', 'body': 'body',
+                                   'author': user.username}) + '\n')
+        with self.assertRaises(CommandError):
+            call_command('import_blog', path, '--drop-indexes', stdout=StringIO())
+        shutil.rmtree(os.path.dirname(path))
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Post._meta.db_table)
+        self.assertIn('blog_post_title_idx', constraints)
+        self.assertFalse(Post.objects.filter(pk=101).exists())
+        self.assertEqual(counts.count(Post), 100)
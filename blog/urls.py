@@ -1,7 +1,7 @@
 from django.conf.urls import include
 from rest_framework import routers
 from django.urls import path
-from . import views
+from . import async_views, views
 
 
 
@@ -10,7 +10,10 @@ app_name = 'blog'
 router = routers.DefaultRouter()
 router.register(r'api/post', views.PostViewSet, basename='post')
 router.register(r'api/comment', views.CommentViewSet, basename='comment')
+router.register(r'api/post/(?P<post_pk>\d+)/comments', views.PostCommentViewSet, basename='post-comments')
 router.register(r'api/usertag', views.UserTagViewSet, basename='usertag')
+router.register(r'api/like', views.LikeViewSet, basename='like')
+router.register(r'api/profile', views.RequestProfileViewSet, basename='profile')
 urlpatterns = [
     #/blog/
     path("", views.index, name='index'),
@@ -20,8 +23,28 @@ urlpatterns = [
     path("login", views.MyLoginView.as_view(), name='login'),
     #/blog/logout
     path("logout", views.logOut, name='logout'),
+    #/blog/api/token
+    path("api/token", views.ObtainTokenView.as_view(), name='token'),
+    #/blog/api/cache-stats
+    path("api/cache-stats", views.CacheStatsView.as_view(), name='cache-stats'),
+    #/blog/api/export
+    path("api/export", views.ExportView.as_view(), name='export'),
+    #/blog/async, the read endpoints below as async views for ASGI, see blog.async_views
+    path("async", async_views.index, name='async-index'),
+    #/blog/api/async/post
+    path("api/async/post", async_views.post_list, name='async-post-list'),
+    #/blog/api/async/post/pk
+    path("api/async/post/<int:pk>", async_views.post_detail, name='async-post-detail'),
+    #/blog/api/async/post/tagged-users/pk
+    path("api/async/post/tagged-users/<int:pk>", async_views.tagged_users, name='async-post-tagged-users'),
+    #/blog/api/async/post/tagged-posts/pk
+    path("api/async/post/tagged-posts/<int:pk>", async_views.tagged_posts, name='async-post-tagged-posts'),
+    #/blog/api/async/comment
+    path("api/async/comment", async_views.comment_list, name='async-comment-list'),
     #/blog/api/post
     #/blog/api/comment
+    #/blog/api/post/pk/comments
+    #/blog/api/profile
     path('', include(router.urls)),
 
 ]
\ No newline at end of file
@@ -1,42 +1,72 @@
 
 from blog.api.serializers import CommentPostSerializer, UserTagSerializer, UserSerializer
-from blog.api.serializers import PostSerializer, CommentSerializer, RelatedPostSerializer
-from rest_framework.filters import OrderingFilter, SearchFilter
+from blog.api.serializers import PostSerializer, CommentSerializer, TaggedPostSerializer, FilteredTaggedPostSerializer
+from blog.api.serializers import LikeBatchSerializer, UserTagBatchSerializer, RequestProfileSerializer
+from rest_framework.authtoken.serializers import AuthTokenSerializer
+from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.viewsets import GenericViewSet, ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.mixins import ListModelMixin
 from django.contrib.auth.views import LoginView
 from rest_framework.decorators import action
+from rest_framework.views import APIView
 from rest_framework.response import Response
-from .models import Post, Comment, UserTag, Like
+from rest_framework import status
+from .models import Post, Comment, UserTag, Like, TaggedPost, RequestProfile
 from django.contrib.auth import logout
+from django.contrib.auth.models import User
 from django.shortcuts import redirect
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.urls import reverse_lazy
 from django.shortcuts import render
 from django.contrib import messages
+from blog.search import PostSearchFilter
 from blog.filters import PostFilter
+from blog.authentication import make_token
+from blog.cache import CachedResponseMixin
+from blog.conditional import ConditionalGetMixin
+from blog.profiling import ServerTimingMixin
+from blog import cache, counts, export
+from rest_framework.exceptions import ValidationError
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from django.conf import settings
 from .forms import SignUpForm
 
 
 # Create your views here.
 def index(request):
     return render(request, 'blog/base_index.html', {
-        "posts": Post.objects.all().count(),
+        "posts": counts.count(Post),
     })
 
 class LikeModelMixin:
     @action(detail=True, methods=['post'], url_path='like', url_name='like')
     def post_like(self, *args, **kwargs):
-        obj = self.get_object()
-        status = "liked"
-        if obj.likes.filter(user=self.request.user).count() > 0:
-            obj.likes.get(user=self.request.user).delete()
-            status = "unliked"
-        else:
-            obj.likes.create(user=self.request.user)
-        obj.save()
-        return Response({'status':status})
+        model = self.queryset.model
+        try:
+            pk = int(self.kwargs['pk'])
+            liked, count = Like.objects.toggle(self.request.user, model, pk)
+        except (ValueError, model.DoesNotExist):
+            raise Http404
+        #The liked object isn't saved: the like is its own row and the toggle moved like_count in the
+        #database, saving a copy loaded before it would write the old count back
+        cache.likes_changed(model, [pk])
+        return Response({'status': "liked" if liked else "unliked", 'likes': count})
+
 
+class DeletedRowMixin:
+    def perform_update(self, serializer):
+        #Saving a row deleted since it was loaded updates nothing and save(update_fields=...) raises,
+        #that's a 404 as if it was already gone when the request came in
+        try:
+            super().perform_update(serializer)
+        except DatabaseError:
+            if self.queryset.model._default_manager.filter(pk=serializer.instance.pk).exists():
+                raise
+            raise Http404
 
 class MyLoginView(LoginView):
     template_name = 'blog/base_form.html'
@@ -51,12 +81,45 @@ class MyLoginView(LoginView):
         return context
 
 
-class PostViewSet(ModelViewSet, LikeModelMixin):
+class ObtainTokenView(ServerTimingMixin, APIView):
+    #Checks the password once and hands out a bearer token for the next requests
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request, *args, **kwargs):
+        serializer = AuthTokenSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        return Response({'token': make_token(user), 'expires_in': settings.BLOG_TOKEN_MAX_AGE})
+
+
+class PostViewSet(ServerTimingMixin, ConditionalGetMixin, CachedResponseMixin, DeletedRowMixin, ModelViewSet, LikeModelMixin):
     queryset = Post.objects.all().order_by('pk')
+    conditional_actions = ('list', 'retrieve', 'get_tagged_posts')
+    etag_fields = {
+        'list': ['author__username'],
+        'retrieve': ['author__username'],
+    }
+    cache_scopes = {
+        'list': ['posts'],
+        'retrieve': ['post:{pk}', 'users'],
+        'get_tagged_users': ['tags'],
+        'get_tagged_posts': ['tags', 'titles'],
+    }
+    #The most queries each read may run whatever the data size, authentication and response cache
+    #aside: the ETag rows and the page. QueryBudgetTest holds the viewsets to it.
+    query_budget = {
+        'list': 2,
+        'retrieve': 2,
+        'get_tagged_users': 1,
+        'get_tagged_posts': 2,
+    }
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
+    filter_backends = [DjangoFilterBackend, OrderingFilter, PostSearchFilter]
     search_fields = ['title', 'body', 'author__username']
+    #non-null fields only, the keyset pagination seeks on them
+    ordering_fields = ['title', 'safe', 'created_at']
     filterset_class = PostFilter
                  
     def perform_create(self, serializer):
@@ -66,28 +129,67 @@ class PostViewSet(ModelViewSet, LikeModelMixin):
         if self.action == 'get_tagged_users':
             return UserSerializer
         elif self.action == 'get_tagged_posts':
-            return RelatedPostSerializer
+            return FilteredTaggedPostSerializer if self.tagged_posts_filtered() else TaggedPostSerializer
         return super().get_serializer_class()
     
     def get_queryset(self):
         if self.action == 'get_tagged_users':
-            return Post.objects.get(pk=self.kwargs['pk']).tagged_users.all().order_by('pk')
+            return User.objects.filter(tagged_users=self.kwargs['pk']).order_by('pk')
+        elif self.action == 'get_tagged_posts' and self.tagged_posts_filtered():
+            return (Post.objects.filter(usertag__user=self.kwargs['pk'])
+                    .annotate(tagged_at=F('usertag__created_at')).order_by('pk'))
         elif self.action == 'get_tagged_posts':
-            return Post.objects.filter(tagged_users__pk=self.kwargs['pk']).order_by('pk')
+            return TaggedPost.objects.filter(user=self.kwargs['pk']).order_by('-created_at', '-pk')
+        elif self.action in ('list', 'retrieve'):
+            return super().get_queryset().with_stats()
         return super().get_queryset()
+
+    def filter_queryset(self, queryset):
+        #the post filters run on posts, not on the feed rows
+        if self.action == 'get_tagged_posts' and not self.tagged_posts_filtered():
+            return queryset
+        return super().filter_queryset(queryset)
+
+    def get_cache_scopes(self):
+        scopes = super().get_cache_scopes()
+        if self.action == 'get_tagged_posts' and self.tagged_posts_filtered():
+            #the filters and the search read the posts' other columns
+            return scopes + ['posts']
+        return scopes
+
+    def tagged_posts_filtered(self):
+        #The feed rows don't have the columns the post list filters, orders and searches on: with any
+        #of those parameters the tagged posts are read through blog_post as before the feed, by pk
+        return any(param in self.request.query_params for param in
+                   [*self.filterset_class.base_filters, PostSearchFilter.search_param,
+                    PostSearchFilter.search_mode_param, *PostSearchFilter.ordering_params])
     
     #/blog/api/post/tagged-users/pk
     @action(detail=False, methods=['get'], url_path='tagged-users/(?P<pk>[^/.]+)', url_name='tagged-users', filter_backends=[])
     def get_tagged_users(self, *args, **kwargs):
         return self.list(self.request, *args, **kwargs)
     
-    #/blog/api/post/tagged-posts/pk
+    #/blog/api/post/tagged-posts/pk, newest tag first, read from the feed table
     @action(detail=False, methods=['get'], url_path='tagged-posts/(?P<pk>[^/.]+)', url_name='tagged-posts')
     def get_tagged_posts(self, *args, **kwargs):
         return self.list(self.request, *args, **kwargs)
 
-class CommentViewSet(ModelViewSet, LikeModelMixin):
+class CommentViewSet(ServerTimingMixin, ConditionalGetMixin, CachedResponseMixin, DeletedRowMixin, ModelViewSet, LikeModelMixin):
     queryset = Comment.objects.all().order_by('pk')
+    #comments show their post's title
+    conditional_fields = ('updated_at', 'post__updated_at')
+    etag_fields = {
+        'list': ['author__username'],
+        'retrieve': ['author__username'],
+    }
+    cache_scopes = {
+        'list': ['comments'],
+        'retrieve': ['comment:{pk}', 'titles', 'users'],
+    }
+    query_budget = {
+        'list': 2,
+        'retrieve': 2,
+    }
     permission_classes = [IsAuthenticated]
                  
     def perform_create(self, serializer):
@@ -97,14 +199,142 @@ class CommentViewSet(ModelViewSet, LikeModelMixin):
         if self.request.method == 'POST':
             return CommentPostSerializer
         return CommentSerializer
-    
-    
-class UserTagViewSet(ModelViewSet):
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            #the author and post the serializer shows, in the same query
+            return super().get_queryset().select_related('author', 'post')
+        return super().get_queryset()
+
+class PostCommentViewSet(ServerTimingMixin, ConditionalGetMixin, CachedResponseMixin, ListModelMixin, GenericViewSet):
+    #/blog/api/post/<post_pk>/comments, oldest first, seeking on the (post, created_at, id) index
+    serializer_class = CommentSerializer
+    permission_classes = [IsAuthenticated]
+    conditional_fields = ('updated_at', 'post__updated_at')
+    etag_fields = {
+        'list': ['author__username'],
+    }
+    cache_scopes = {
+        'list': ['comments'],
+    }
+    query_budget = {
+        'list': 2,
+    }
+
+    def get_queryset(self):
+        return (Comment.objects.filter(post=self.kwargs['post_pk'])
+                .select_related('author', 'post').order_by('created_at', 'pk'))
+
+    def post_exists(self):
+        #Only asked for an empty page, a post with comments exists
+        if not hasattr(self, '_post_exists'):
+            self._post_exists = Post.objects.filter(pk=self.kwargs['post_pk']).exists()
+        return self._post_exists
+
+    def conditional_found(self):
+        return self.post_exists()
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if not page and not self.post_exists():
+            raise Http404
+        return page
+
+
+class LikeViewSet(ServerTimingMixin, GenericViewSet):
+    serializer_class = LikeBatchSerializer
+    permission_classes = [IsAuthenticated]
+    models = {'post': Post, 'comment': Comment}
+
+    #/blog/api/like/batch
+    @action(detail=False, methods=['post'], url_path='batch', url_name='batch')
+    def batch(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        entries = [(self.models[entry['content_type']], entry['object_id'], entry['liked'])
+                   for entry in serializer.validated_data['likes']]
+        state = Like.objects.apply_batch(request.user, entries)
+        for model in self.models.values():
+            cache.likes_changed(model, [pk for (changed, pk) in state if changed is model])
+        names = {model: name for name, model in self.models.items()}
+        results, missing = [], []
+        for model, object_id in dict.fromkeys(entry[:2] for entry in entries):
+            entry = {'content_type': names[model], 'object_id': object_id}
+            if (model, object_id) not in state:
+                missing.append(entry)
+                continue
+            entry['liked'], entry['likes'] = state[(model, object_id)]
+            results.append(entry)
+        return Response({'results': results, 'missing': missing})
+
+class CacheStatsView(ServerTimingMixin, APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(cache.stats())
+
+class ExportView(ServerTimingMixin, APIView):
+    #Streams the whole blog as NDJSON or CSV, ?since= only rows written after that time.
+    #?output= picks the format, DRF keeps ?format= for its own renderers.
+    permission_classes = [IsAdminUser]
+    content_types = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get(self, request, *args, **kwargs):
+        output = request.query_params.get('output', 'ndjson')
+        names = request.query_params.get('models', ','.join(export.EXPORTS)).split(',')
+        if output not in export.OUTPUTS:
+            raise ValidationError({'output': f'One of {", ".join(export.OUTPUTS)}'})
+        if any(name not in export.EXPORTS for name in names):
+            raise ValidationError({'models': f'Comma separated, from {", ".join(export.EXPORTS)}'})
+        try:
+            since = export.parse_since(request.query_params.get('since'))
+        except ValueError as error:
+            raise ValidationError({'since': str(error)})
+        #the next incremental export starts here, overlapping this one
+        watermark = export.next_since(timezone.now())
+        response = StreamingHttpResponse(export.lines(output, names, since, settings.BLOG_EXPORT_CHUNK_SIZE),
+                                         content_type=self.content_types[output])
+        response['X-Export-Watermark'] = watermark.isoformat()
+        response['Content-Disposition'] = f'attachment; filename="blog.{output}"'
+        return response
+
+class RequestProfileViewSet(ServerTimingMixin, ReadOnlyModelViewSet):
+    #The stored profiles, newest first, see blog.profiling
+    queryset = RequestProfile.objects.select_related('user').defer('stats').order_by('-pk')
+    serializer_class = RequestProfileSerializer
+    permission_classes = [IsAdminUser]
+    filter_backends = []
+
+    #/blog/api/profile/pk/download, python -m pstats or snakeviz read it
+    @action(detail=True, methods=['get'], url_path='download', url_name='download')
+    def download(self, request, *args, **kwargs):
+        profile = self.get_object()
+        response = HttpResponse(profile.stats_file(), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile.pk}.prof"'
+        return response
+
+class UserTagViewSet(ServerTimingMixin, ModelViewSet):
     http_method_names = ['post']
     queryset = UserTag.objects.all().order_by('pk')
     serializer_class = UserTagSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_serializer_class(self):
+        if self.action == 'batch':
+            return UserTagBatchSerializer
+        return super().get_serializer_class()
+
+    #/blog/api/usertag/batch
+    @action(detail=False, methods=['post'], url_path='batch', url_name='batch')
+    def batch(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        post, users = serializer.validated_data['post'], serializer.validated_data['users']
+        count = UserTag.objects.tag_batch(post, users)
+        cache.bump('tags')
+        cache.post_changed(post)
+        return Response({'post': post, 'users': users, 'tagged_count': count}, status=status.HTTP_201_CREATED)
+
 def signUp(request):
     if request.method == 'POST':
         form = SignUpForm(request.POST)
@@ -52,6 +52,9 @@ INSTALLED_APPS = THIRD_APPS + LOCAL_APPS + DJANGO_APPS
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'blog.middleware.QueryCountMiddleware',
+    'blog.middleware.ServerTimingMiddleware',
+    'blog.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,6 +97,10 @@ DATABASES = {
     }
 }
 
+# Read replicas: add their aliases to DATABASES, mirrored in tests, and list them in BLOG_READ_REPLICAS
+#   DATABASES['replica'] = {**DATABASES['default'], 'HOST': 'replica.local', 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['blog.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -131,6 +138,19 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'myblog',
+    }
+}
+
+# The response cache has to be shared by all the workers, e.g.
+#   CACHES['shared'] = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379'}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -139,10 +159,11 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_REDIRECT_URL = 'blog:index'
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'blog.pagination.KeysetPagination',
     'PAGE_SIZE': 42,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        'blog.authentication.SignedTokenAuthentication',
+        'blog.authentication.CachedBasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -150,4 +171,65 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
-}
\ No newline at end of file
+}
+
+# Lifetime in seconds of the bearer tokens issued by /blog/api/token
+BLOG_TOKEN_MAX_AGE = 60 * 60 * 24 * 7
+
+# Seconds to remember verified Basic auth credentials, 0 runs the password hasher on every request
+BLOG_BASIC_AUTH_CACHE_TTL = 0
+
+# Default ?search= behaviour of the post list: 'substring' (icontains) or 'fulltext',
+# clients pick per request with ?search_mode=
+BLOG_SEARCH_MODE = 'substring'
+
+# Cache alias and lifetime in seconds of the post/comment API responses, 0 disables the cache. The
+# alias must be a cache every worker shares (check blog.E001), a write only invalidates the responses
+# through the cache it bumps, e.g. 'shared' above with 300
+BLOG_RESPONSE_CACHE_ALIAS = 'default'
+BLOG_RESPONSE_CACHE_TIMEOUT = 0
+
+# Seconds a signal maintained table count is trusted before it is recounted, see blog.counts
+BLOG_COUNT_MAX_AGE = 60 * 60
+
+# Counter rows per table the signals spread their bumps over, more lets more writers insert at once
+BLOG_COUNT_SLOTS = 16
+
+# The format the post image variants are encoded in (WEBP or JPEG) and its quality
+BLOG_IMAGE_FORMAT = 'WEBP'
+BLOG_IMAGE_QUALITY = 80
+
+# Background tasks (manage.py run_tasks): attempts before a task is marked failed, the first retry
+# delay in seconds, doubling up to the max, and how long a worker owns a task before it's retried
+BLOG_TASK_MAX_ATTEMPTS = 5
+BLOG_TASK_RETRY_DELAY = 10
+BLOG_TASK_MAX_RETRY_DELAY = 60 * 60
+BLOG_TASK_LEASE = 5 * 60
+
+# Rows fetched per round trip by the streaming export (/blog/api/export, manage.py export_blog)
+BLOG_EXPORT_CHUNK_SIZE = 2000
+# Seconds the watermark of an incremental export is set back, longer than the longest write
+# transaction, so rows committed after the export started aren't missed (see blog.export.next_since)
+BLOG_EXPORT_OVERLAP = 5 * 60
+
+# Database aliases the reads of GET/HEAD/OPTIONS requests are spread over (see blog.routers), empty reads from default
+BLOG_READ_REPLICAS = []
+
+# After a write the client reads from the primary for this many seconds, longer than the replica lag,
+# remembered in this cookie
+BLOG_REPLICA_STICKY_SECONDS = 15
+BLOG_REPLICA_COOKIE = 'blog_primary'
+
+# Send the per-request query count and time as X-DB-Queries / X-DB-Time-ms, see
+# blog.middleware.QueryCountMiddleware, they are logged at DEBUG on the blog.middleware logger either way
+BLOG_QUERY_COUNT_HEADERS = DEBUG
+
+# Send a Server-Timing header (auth, db, serialize, render, app and total ms), see blog.profiling:
+# True to everyone, 'staff' to staff users only, False to nobody. It tells how long the queries take.
+BLOG_SERVER_TIMING = True if DEBUG else 'staff'
+
+# Fraction of the requests profiled with cProfile, e.g. 0.001, stored by manage.py run_tasks, and how many
+# of the newest profiles are kept, staff download them from /blog/api/profile. Staff profile a request of theirs with ?profile=1
+# or an X-Blog-Profile header whatever the rate.
+BLOG_PROFILE_SAMPLE_RATE = 0
+BLOG_PROFILE_KEEP = 200